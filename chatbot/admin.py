@@ -1,12 +1,23 @@
 from django.contrib import admin
-from .models import Message, SkipKeyword, SystemPromptRule, LineUser
+from django.db.models import Sum
+
+from . import analytics, response_cache
+from .models import (
+    HourlyRuleStats, LineUser, Message, SessionSummary, SkipKeyword, SystemPromptRule, WebhookEvent,
+)
 
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
-    list_display = ('user_id', 'role', 'content', 'timestamp', 'session_id')
-    search_fields = ('user_id', 'content', 'session_id')
-    list_filter = ('session_id', 'user_id')
+    list_display = ('user_id', 'role', 'content', 'system_prompt_rule', 'timestamp', 'session_id')
+    # 只做完全比對，可以使用索引；不對 content 做 LIKE '%...%' 全表掃描
+    search_fields = ('=user_id', '=session_id')
+    # 日期階層走 timestamp 索引、規則篩選只查 SystemPromptRule，不對 session_id / user_id 做 SELECT DISTINCT
+    date_hierarchy = 'timestamp'
+    list_filter = ('system_prompt_rule',)
+    list_select_related = ('system_prompt_rule',)
     ordering = ('-timestamp',)
+    # 不另外計算整張表的總筆數
+    show_full_result_count = False
 
 @admin.register(SkipKeyword)
 class SkipKeywordAdmin(admin.ModelAdmin):
@@ -20,10 +31,43 @@ class SkipKeywordAdmin(admin.ModelAdmin):
 
 @admin.register(SystemPromptRule)
 class SystemPromptRuleAdmin(admin.ModelAdmin):
-    list_display = ('trigger_text', 'created_by', 'created_at')
+    list_display = (
+        'trigger_text', 'llm_backend', 'llm_model', 'cache_responses', 'cache_hit_rate', 'cached_token_ratio',
+        'created_by', 'created_at'
+    )
+    list_filter = ('cache_responses', 'llm_backend')
     search_fields = ('trigger_text', 'system_prompt')
     readonly_fields = ('created_at',)
 
+    def get_queryset(self, request):
+        # 從每小時統計加總，不 join 整張 Message
+        return super().get_queryset(request).annotate(
+            prompt_tokens_total=Sum('hourly_stats__prompt_tokens'),
+            cached_tokens_total=Sum('hourly_stats__cached_tokens'),
+        )
+
+    @admin.display(description='Prompt 快取比例')
+    def cached_token_ratio(self, obj):
+        if not obj.prompt_tokens_total:
+            return '-'
+        return f"{(obj.cached_tokens_total or 0) / obj.prompt_tokens_total:.0%}"
+
+    def get_changelist_instance(self, request):
+        changelist = super().get_changelist_instance(request)
+        # 一次讀取所有規則的快取命中次數，不必每一列各查一次
+        cache_stats = response_cache.stats()
+        for rule in changelist.result_list:
+            rule.cache_stats = cache_stats.get(rule.id, {'hits': 0, 'misses': 0})
+        return changelist
+
+    @admin.display(description='快取命中率')
+    def cache_hit_rate(self, obj):
+        stats = getattr(obj, 'cache_stats', None) or {'hits': 0, 'misses': 0}
+        total = stats['hits'] + stats['misses']
+        if not total:
+            return '-'
+        return f"{stats['hits'] / total:.0%}（{stats['hits']}/{total}）"
+
     def save_model(self, request, obj, form, change):
         if not obj.pk:
             obj.created_by = request.user
@@ -32,7 +76,55 @@ class SystemPromptRuleAdmin(admin.ModelAdmin):
 
 @admin.register(LineUser)
 class LineUserAdmin(admin.ModelAdmin):
-    list_display = ('user_id', 'language', 'created_at')
+    list_display = ('user_id', 'language', 'message_count', 'created_at')
     list_filter = ('language', 'created_at')
     search_fields = ('user_id',)
-    ordering = ('-created_at',)
\ No newline at end of file
+    ordering = ('-created_at',)
+
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ('id', 'event_type', 'user_id', 'status', 'attempts', 'created_at', 'processed_at')
+    list_filter = ('status', 'event_type')
+    search_fields = ('user_id',)
+    readonly_fields = ('created_at', 'processed_at')
+    ordering = ('-id',)
+
+
+
+@admin.register(SessionSummary)
+class SessionSummaryAdmin(admin.ModelAdmin):
+    list_display = ('user_id', 'session_id', 'token_count', 'updated_at')
+    search_fields = ('user_id', 'session_id')
+    readonly_fields = ('covered_until_id', 'token_count', 'updated_at')
+    ordering = ('-updated_at',)
+
+
+@admin.register(HourlyRuleStats)
+class HourlyRuleStatsAdmin(admin.ModelAdmin):
+    """統計儀表板：列表上方顯示最近幾天的總計、各規則與每日統計，資料由 rollup_analytics 產生"""
+    change_list_template = 'admin/chatbot/hourlyrulestats/change_list.html'
+    list_display = (
+        'hour', 'system_prompt_rule', 'user_messages', 'assistant_messages', 'users',
+        'prompt_tokens', 'completion_tokens', 'avg_latency',
+    )
+    date_hierarchy = 'hour'
+    list_filter = ('system_prompt_rule',)
+    list_select_related = ('system_prompt_rule',)
+    ordering = ('-hour',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.display(description='平均延遲')
+    def avg_latency(self, obj):
+        if not obj.latency_count:
+            return '-'
+        return f"{obj.latency_ms_total / obj.latency_count / 1000:.2f} 秒"
+
+    def changelist_view(self, request, extra_context=None):
+        extra_context = {**(extra_context or {}), 'dashboard': analytics.dashboard()}
+        return super().changelist_view(request, extra_context)
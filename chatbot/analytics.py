@@ -0,0 +1,142 @@
+# chatbot/analytics.py
+# 每小時統計：由 rollup_analytics 定期把 Message 彙總到 HourlyRuleStats，後台儀表板只讀彙總表，不掃描 Message。
+# 以整點為單位重新計算（先刪除再寫入），同一個小時重複計算結果相同；
+# 每次從最後一個已統計的小時再往前 LINEBOT_ANALYTICS_LOOKBACK_HOURS 小時開始，涵蓋較晚寫入的訊息。
+# 同一時間只允許一個 rollup 執行（shared 快取的鎖），避免重疊執行時重複寫入統計。
+from collections import defaultdict
+from datetime import timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q, Sum
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from .models import HourlyRuleStats, Message
+
+ROLLUP_WINDOW = timedelta(days=1)  # 每個查詢最多彙總的時間範圍
+DASHBOARD_DAYS = 7
+ROLLUP_LOCK_KEY = 'analytics_rollup'
+ROLLUP_LOCK_TIMEOUT = 3600  # 執行中斷時鎖最多保留的秒數
+SUM_FIELDS = (
+    'user_messages', 'assistant_messages', 'prompt_tokens', 'cached_tokens', 'completion_tokens',
+    'latency_ms_total', 'latency_count',
+)
+
+
+class RollupInProgressError(Exception):
+    """另一個 rollup 正在執行"""
+
+
+def floor_hour(value):
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def rollup_range(start, end):
+    """重新計算 [start, end) 之間每小時的統計，回傳寫入的筆數"""
+    rows = (
+        Message.objects
+        .filter(timestamp__gte=start, timestamp__lt=end)
+        # 以 UTC 取整點，MySQL 不需要載入時區資料表
+        .annotate(hour=TruncHour('timestamp', tzinfo=dt_timezone.utc))
+        .values('hour', 'system_prompt_rule')
+        .annotate(
+            user_messages=Count('id', filter=Q(role='user')),
+            assistant_messages=Count('id', filter=Q(role='assistant')),
+            users=Count('user_id', distinct=True),
+            prompt_tokens=Sum('prompt_tokens'),
+            cached_tokens=Sum('cached_tokens'),
+            completion_tokens=Sum('completion_tokens'),
+            latency_ms_total=Sum('latency_ms'),
+            latency_count=Count('latency_ms'),
+            latency_ms_max=Max('latency_ms'),
+        )
+        .order_by()
+    )
+    stats = [
+        HourlyRuleStats(
+            hour=row['hour'],
+            system_prompt_rule_id=row['system_prompt_rule'],
+            users=row['users'],
+            latency_ms_max=row['latency_ms_max'] or 0,
+            **{field: row[field] or 0 for field in SUM_FIELDS},
+        )
+        for row in rows
+    ]
+
+    with transaction.atomic():
+        HourlyRuleStats.objects.filter(hour__gte=start, hour__lt=end).delete()
+        HourlyRuleStats.objects.bulk_create(stats)
+    return len(stats)
+
+
+def rollup(since=None):
+    """彙總 since 到目前這個小時的統計；since 未指定時接續上次的進度，回傳 (起始時間, 寫入筆數)；
+    另一個 rollup 正在執行時丟出 RollupInProgressError"""
+    if not caches['shared'].add(ROLLUP_LOCK_KEY, 1, timeout=ROLLUP_LOCK_TIMEOUT):
+        raise RollupInProgressError()
+    try:
+        return _rollup(since)
+    finally:
+        caches['shared'].delete(ROLLUP_LOCK_KEY)
+
+
+def _rollup(since):
+    if since is None:
+        last = HourlyRuleStats.objects.aggregate(last=Max('hour'))['last']
+        if last is not None:
+            since = last - timedelta(hours=settings.LINEBOT_ANALYTICS_LOOKBACK_HOURS)
+        else:
+            since = Message.objects.aggregate(first=Min('timestamp'))['first']
+            if since is None:
+                return None, 0
+
+    start = floor_hour(since)
+    end = floor_hour(timezone.now()) + timedelta(hours=1)
+    written = 0
+    window_start = start
+    while window_start < end:
+        window_end = min(window_start + ROLLUP_WINDOW, end)
+        written += rollup_range(window_start, window_end)
+        window_start = window_end
+    return start, written
+
+
+def _summarize(stats):
+    summary = {field: sum(s[field] for s in stats) for field in SUM_FIELDS}
+    summary['avg_latency_ms'] = (
+        round(summary['latency_ms_total'] / summary['latency_count']) if summary['latency_count'] else None
+    )
+    summary['max_latency_ms'] = max((s['latency_ms_max'] for s in stats), default=0)
+    # 每小時的使用者數是各小時內不重複的人數，跨小時相加會重複計算，只顯示尖峰
+    summary['peak_hourly_users'] = max((s['users'] for s in stats), default=0)
+    return summary
+
+
+def dashboard(days=DASHBOARD_DAYS):
+    """儀表板資料：最近 days 天的總計、各規則與每日統計"""
+    since = floor_hour(timezone.now()) - timedelta(days=days)
+    stats = list(
+        HourlyRuleStats.objects
+        .filter(hour__gte=since)
+        .values('hour', 'system_prompt_rule', 'system_prompt_rule__trigger_text', 'users', 'latency_ms_max',
+                *SUM_FIELDS)
+    )
+
+    by_rule = defaultdict(list)
+    by_day = defaultdict(list)
+    for s in stats:
+        by_rule[s['system_prompt_rule__trigger_text'] or '（預設）'].append(s)
+        by_day[timezone.localtime(s['hour']).date()].append(s)
+
+    rules = sorted(
+        ({'name': name, **_summarize(rows)} for name, rows in by_rule.items()),
+        key=lambda rule: rule['user_messages'], reverse=True,
+    )
+    return {
+        'days': days,
+        'totals': _summarize(stats),
+        'rules': rules,
+        'daily': [{'day': day, **_summarize(rows)} for day, rows in sorted(by_day.items(), reverse=True)],
+    }
@@ -0,0 +1,247 @@
+# chatbot/async_views.py
+import asyncio
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseBadRequest
+from django.views.decorators.csrf import csrf_exempt
+from linebot.exceptions import InvalidSignatureError
+from linebot.models import TextSendMessage
+
+from . import commands, metrics
+from .dedup import filter_new_events, release_events
+from .history import pending_summary_request, store_summary
+from .limiter import (
+    BUSY_REPLY, acquire_user, atake_llm_token, defer_message, has_deferred, is_latest_deferred, pop_deferred,
+    release_user,
+)
+from .llm_backends import resolve
+from .llm_gateway import achat, reply_deadline
+from .line_client import AsyncLoadingIndicator, areply_or_push, split_text
+from .response_cache import cache_reply, get_cached_reply
+from .rule_cache import is_skip_keyword
+from .streaming import AsyncStreamReplySender
+from .views import (
+    ERROR_REPLY, parser,
+    get_line_user, get_line_users, group_text_events, needs_line_user, prepare_conversation, record_llm_call,
+    report_reply_error, save_turn, text_messages,
+)
+
+@csrf_exempt
+async def acallback(request):
+    signature = request.headers.get('X-Line-Signature')
+    body = request.body.decode('utf-8')
+
+    try:
+        with metrics.span('signature_verify'):
+            events = parser.parse(body, signature)
+    except InvalidSignatureError:
+        metrics.count('linebot_invalid_signatures_total')
+        return HttpResponseBadRequest('Invalid signature')
+
+    await ahandle_events(events)
+    return HttpResponse('OK')
+
+async def ahandle_events(events):
+    """handle_events 的非同步版本：不同使用者並行，同一使用者依序處理"""
+    groups = group_text_events(await sync_to_async(filter_new_events)(events))
+    if not groups:
+        return
+
+    with metrics.span('user_upsert'):
+        line_users = await sync_to_async(get_line_users)(
+            [user_id for user_id, user_events in groups.items() if needs_line_user(user_events)]
+        )
+    semaphore = asyncio.Semaphore(settings.LINEBOT_BATCH_CONCURRENCY)
+
+    async def handle_user_events(user_id):
+        user_events = groups[user_id]
+        async with semaphore:
+            for index, event in enumerate(user_events):
+                try:
+                    await ahandle_message(event, line_users.get(user_id), wait=index == len(user_events) - 1)
+                except Exception:
+                    metrics.count('linebot_errors_total', stage='handle_message')
+                    # 寫入資料庫前就失敗的事件（送出回覆的錯誤不會丟到這裡）釋放掉，LINE 重送時才會重新處理
+                    await sync_to_async(release_events)(user_events[index:])
+                    raise
+
+    await asyncio.gather(*(handle_user_events(user_id) for user_id in groups))
+
+async def ahandle_message(event, line_user=None, wait=True):
+    user_id = event.source.user_id
+    user_message = event.message.text.strip()
+
+    # 指令最先處理，只載入指令需要的資源
+    matched = commands.match(user_message)
+    if matched:
+        metrics.count('linebot_commands_total', command=matched[0].name)
+        reply = await sync_to_async(commands.run)(matched, user_id, line_user)
+        reply_token, _ = reply_deadline(event.reply_token, event.timestamp / 1000)
+        try:
+            with metrics.span('reply_send'):
+                await areply_or_push(reply_token, user_id, text_messages(reply))
+        except Exception as e:
+            report_reply_error(e)
+        return
+
+    if line_user is None:
+        line_user = await sync_to_async(get_line_user)(user_id)
+
+    # 檢查是否為應跳過的關鍵字
+    with metrics.span('rule_matching'):
+        skipped = await sync_to_async(is_skip_keyword)(user_message)
+    if skipped:
+        metrics.count('linebot_skipped_messages_total')
+        return
+
+    # 連續傳來的訊息先暫存，debounce 期間沒有新訊息才合併成一輪回答
+    if settings.LINEBOT_DEBOUNCE_SECONDS:
+        deferred = await sync_to_async(defer_message)(user_id, user_message, event.reply_token)
+        if not wait:
+            return
+        await asyncio.sleep(settings.LINEBOT_DEBOUNCE_SECONDS)
+        if await sync_to_async(is_latest_deferred)(deferred):
+            await adrain_deferred(line_user)
+        return
+
+    # 同一使用者同時只跑一個 LLM 回合，回覆期間新進的訊息先暫存，之後合併成一輪回答
+    if not await sync_to_async(acquire_user)(user_id):
+        await sync_to_async(defer_message)(user_id, user_message, event.reply_token)
+        metrics.count('linebot_deferred_messages_total')
+        # 前一輪可能在暫存寫入前就已結束並檢查過暫存訊息，暫存後自己再試一次
+        await adrain_deferred(line_user)
+        return
+
+    try:
+        await aanswer_turn(line_user, [user_message], event.reply_token, event.timestamp / 1000)
+    finally:
+        deferred = await sync_to_async(release_user)(user_id)
+
+    # 只有回答期間有訊息暫存時才需要再處理
+    if deferred:
+        await adrain_deferred(line_user)
+
+async def aanswer_turn(line_user, user_messages, reply_token, received_at=None):
+    """answer_turn 的非同步版本"""
+    user_id = line_user.user_id
+    sender = None
+
+    # 思考動畫在快取未命中、要呼叫 LLM 時才在背景送出；送出回覆前一定先停止
+    indicator = AsyncLoadingIndicator(user_id)
+    try:
+        session_id, system_prompt_rule, messages, window = await sync_to_async(prepare_conversation)(
+            line_user, user_messages
+        )
+
+        assistant_reply = usage = latency = None
+        allowed = await atake_llm_token()
+        # 等待額度也會花時間，送出前才判斷 reply token 是否還有效；過期時用完整的期限，改以 push 回覆
+        reply_token, deadline = reply_deadline(reply_token, received_at)
+        if settings.LINEBOT_STREAMING:
+            sender = AsyncStreamReplySender(reply_token, user_id, indicator)
+        if not allowed:
+            metrics.count('linebot_rate_limited_total')
+            reply = BUSY_REPLY
+        else:
+            try:
+                started = time.perf_counter()
+                with metrics.span('llm'):
+                    assistant_reply, usage = await agenerate_reply(
+                        messages, system_prompt_rule, sender, deadline, indicator
+                    )
+                latency = time.perf_counter() - started
+                reply = assistant_reply
+            except Exception as e:
+                print(f"[!] 產生回覆失敗：{str(e)}")
+                metrics.count('linebot_errors_total', stage='llm')
+                reply = ERROR_REPLY
+
+        with metrics.span('persistence'):
+            await sync_to_async(save_turn)(
+                line_user, session_id, system_prompt_rule, user_messages, assistant_reply, usage, latency
+            )
+    finally:
+        await indicator.stop()
+
+    try:
+        with metrics.span('reply_send'):
+            if sender:
+                # 串流已經送出回覆；出錯時才補送錯誤訊息
+                if assistant_reply is None:
+                    await sender.send([reply])
+            else:
+                await areply_or_push(reply_token, user_id, TextSendMessage(text=reply))
+    except Exception as e:
+        report_reply_error(e)
+
+    await aupdate_session_summary(user_id, session_id, window)
+
+async def adrain_deferred(line_user):
+    """drain_deferred 的非同步版本"""
+    user_id = line_user.user_id
+    try:
+        while await sync_to_async(has_deferred)(user_id) and await sync_to_async(acquire_user)(user_id):
+            try:
+                # 別的 worker 可能已經更新過對話狀態
+                await line_user.arefresh_from_db(fields=['session_id', 'system_prompt_rule', 'message_count'])
+                user_messages, reply_token, received_at = await sync_to_async(pop_deferred)(user_id)
+                if user_messages:
+                    await aanswer_turn(line_user, user_messages, reply_token, received_at)
+            finally:
+                await sync_to_async(release_user)(user_id)
+    except Exception as e:
+        print(f"[!] 回答暫存的訊息失敗：{str(e)}")
+        metrics.count('linebot_errors_total', stage='drain_deferred')
+
+async def agenerate_reply(messages, system_prompt_rule, sender=None, deadline=None, indicator=None):
+    """generate_reply 的非同步版本"""
+    backend, model = resolve(system_prompt_rule)
+    cache_model = f"{backend}:{model}"
+    cached = await sync_to_async(get_cached_reply)(cache_model, messages, system_prompt_rule)
+    if cached is not None:
+        if sender:
+            await sender.send(split_text(cached))
+        return cached, None
+
+    if indicator:
+        indicator.start()
+    started = time.perf_counter()
+    if sender:
+        stream, used_model = await achat(
+            model,
+            messages,
+            deadline,
+            backend,
+            stream=True,
+            stream_options={'include_usage': True}
+        )
+        reply = await sender.send_stream(stream)
+        usage = sender.usage
+    else:
+        response, used_model = await achat(model, messages, deadline, backend)
+        reply = response.choices[0].message.content.strip()
+        usage = response.usage
+    record_llm_call(system_prompt_rule, used_model, time.perf_counter() - started, usage)
+
+    # 備援模型的回覆不寫入快取
+    if used_model == model:
+        await sync_to_async(cache_reply)(cache_model, messages, system_prompt_rule, reply)
+    return reply, usage
+
+async def aupdate_session_summary(user_id, session_id, window):
+    """update_session_summary 的非同步版本"""
+    request = await sync_to_async(pending_summary_request)(user_id, session_id, window)
+    if request is None:
+        return
+
+    messages, covered_until_id = request
+    try:
+        backend, model = resolve()
+        response, _ = await achat(model, messages, backend=backend)
+        await sync_to_async(store_summary)(
+            user_id, session_id, response.choices[0].message.content.strip(), covered_until_id
+        )
+    except Exception as e:
+        print(f"[!] 更新對話摘要失敗：{str(e)}")
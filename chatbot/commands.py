@@ -0,0 +1,97 @@
+# chatbot/commands.py
+# 指令註冊表：收到訊息時最先以預先編譯好的 regex 比對原始文字。
+# 每個指令宣告需要的資源（使用者資料列、思考動畫），不需要的就不載入，
+# 簡單的指令只需要一次資料庫寫入與一次 reply，不會經過 skip keyword、LLM 與對話紀錄的處理。
+import re
+
+from .history import render_history_page
+from .line_client import loading_indicator
+from .models import LineUser
+from .retention import clear_history
+
+
+class Command:
+    def __init__(self, name, pattern, handler, needs_user=False, needs_loading=False):
+        self.name = name
+        self.pattern = pattern  # 具名群組會當成參數傳給 handler，名稱在所有指令間不能重複
+        self.handler = handler
+        self.needs_user = needs_user  # 需要 LineUser（目前的 session 等），由呼叫端傳入或在這裡載入
+        self.needs_loading = needs_loading  # 執行較久，先送出思考動畫
+
+
+_commands = []
+_matcher = None
+
+
+def command(name, pattern, **needs):
+    """註冊指令的 decorator；handler(user_id, line_user, **參數) 回傳要回覆的文字（str 或 list）"""
+    def register(handler):
+        global _matcher
+        _commands.append(Command(name, pattern, handler, **needs))
+        _matcher = None
+        return handler
+    return register
+
+
+def _compile():
+    alternatives = '|'.join(f"(?P<cmd_{c.name}>{c.pattern})" for c in _commands)
+    return re.compile(rf"^\s*(?:{alternatives})\s*$", re.IGNORECASE)
+
+
+def match(text):
+    """回傳 (Command, 參數 dict)；不是指令時回傳 None"""
+    global _matcher
+    if _matcher is None:
+        _matcher = _compile()
+
+    found = _matcher.match(text)
+    if not found:
+        return None
+    for c in _commands:
+        if found.group(f"cmd_{c.name}") is not None:
+            args = {key: value for key, value in found.groupdict().items() if not key.startswith('cmd_')}
+            return c, {key: value for key, value in args.items() if value is not None}
+    return None
+
+
+def run(matched, user_id, line_user=None):
+    """執行比對到的指令，需要 LineUser 而呼叫端沒有提供時才查詢"""
+    c, args = matched
+    if c.needs_user and line_user is None:
+        line_user, _ = LineUser.objects.get_or_create(user_id=user_id)
+
+    if c.needs_loading:
+        with loading_indicator(user_id):
+            return c.handler(user_id, line_user, **args)
+    return c.handler(user_id, line_user, **args)
+
+
+@command('lang', r'/lang\s+(?P<lang>\S+)')
+def set_language(user_id, line_user, lang):
+    languages = dict(LineUser.LANGUAGE_CHOICES)
+    lang = lang.lower()
+    if lang not in languages:
+        return f"不支援的語言，可以使用：{'、'.join(languages)}"
+
+    # 直接更新，不需要先讀取；使用者還不存在時才建立
+    if not LineUser.objects.filter(user_id=user_id).update(language=lang):
+        LineUser.objects.get_or_create(user_id=user_id, defaults={'language': lang})
+    if line_user is not None:
+        line_user.language = lang
+    return f"語言已切換為 {languages[lang]}"
+
+
+@command('reset', r'/reset')
+def reset(user_id, line_user):
+    clear_history(user_id, line_user)
+    return '對話紀錄已清除，從頭開始吧！'
+
+
+@command('history', r'/history(?:\s+(?P<page>\d+))?', needs_user=True)
+def history(user_id, line_user, page='1'):
+    # /history 或 /history 2：分頁顯示目前 session 的紀錄，第 1 頁為最新
+    page = max(int(page), 1)
+    parts = render_history_page(user_id, line_user.session_id, line_user.message_count, page)
+    if not parts:
+        return '目前沒有紀錄喔～' if page == 1 else '沒有更早的紀錄了～'
+    return parts
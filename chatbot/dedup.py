@@ -0,0 +1,140 @@
+# chatbot/dedup.py
+# 以 webhookEventId 判斷事件是否已處理過，避免 LINE 重送時重複呼叫 OpenAI、重複寫入訊息。
+# 已處理的事件 id 存在 ProcessedEvent（event_id 唯一），前面再加一層各 worker 的記憶體快取；
+# 超過 LINEBOT_DEDUP_TTL 的紀錄每個 process 每 PURGE_INTERVAL 秒刪除一次。
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from . import metrics
+from .models import ProcessedEvent
+
+LOCAL_MAX_ENTRIES = 10000
+PURGE_INTERVAL = 300
+
+_lock = threading.Lock()
+_recent = OrderedDict()
+_last_purge = {'at': 0.0}
+
+
+def _remember(event_id):
+    now = time.monotonic()
+    with _lock:
+        _recent[event_id] = now
+        _recent.move_to_end(event_id)
+        while _recent:
+            oldest_id, seen_at = next(iter(_recent.items()))
+            if len(_recent) <= LOCAL_MAX_ENTRIES and now - seen_at < settings.LINEBOT_DEDUP_TTL:
+                break
+            del _recent[oldest_id]
+
+
+def _seen_locally(event_id):
+    with _lock:
+        seen_at = _recent.get(event_id)
+    return seen_at is not None and time.monotonic() - seen_at < settings.LINEBOT_DEDUP_TTL
+
+
+def _record_suppressed(event_id):
+    metrics.count('linebot_webhook_events_suppressed_total')
+    print(f"略過重複的 webhook 事件：{event_id}")
+
+
+def purge_expired():
+    """刪除超過保存期限的事件 id，每個 process 每 PURGE_INTERVAL 秒最多執行一次"""
+    now = time.monotonic()
+    with _lock:
+        if now - _last_purge['at'] < PURGE_INTERVAL:
+            return
+        _last_purge['at'] = now
+
+    cutoff = timezone.now() - timedelta(seconds=settings.LINEBOT_DEDUP_TTL)
+    try:
+        ProcessedEvent.objects.filter(created_at__lt=cutoff).delete()
+    except Exception as e:
+        print(f"[!] 刪除過期的 webhook 事件紀錄失敗：{str(e)}")
+
+
+def claim_many(event_ids):
+    """回傳第一次看到的事件 id（set）；已處理過的（LINE 重送）記為略過。
+    一次 INSERT 寫入全部 id（重複的忽略），多個時再以本次的 claim_token 查出哪些是這次寫入的，多個 worker 同時收到也只有一個取得"""
+    candidates = []
+    for event_id in dict.fromkeys(event_ids):
+        if _seen_locally(event_id):
+            _record_suppressed(event_id)
+        else:
+            candidates.append(event_id)
+    if not candidates:
+        return set()
+
+    token = uuid.uuid4().hex
+    if len(candidates) == 1:
+        # 一個 webhook 通常只有一個事件：直接 INSERT，違反唯一鍵表示已處理過，不需要再查詢
+        try:
+            with transaction.atomic():
+                ProcessedEvent.objects.create(event_id=candidates[0], claim_token=token)
+            claimed = set(candidates)
+        except IntegrityError:
+            claimed = set()
+    else:
+        ProcessedEvent.objects.bulk_create(
+            [ProcessedEvent(event_id=event_id, claim_token=token) for event_id in candidates],
+            ignore_conflicts=True,
+        )
+        claimed = set(
+            ProcessedEvent.objects
+            .filter(event_id__in=candidates, claim_token=token)
+            .values_list('event_id', flat=True)
+        )
+
+    for event_id in candidates:
+        _remember(event_id)
+        if event_id not in claimed:
+            _record_suppressed(event_id)
+    purge_expired()
+    return claimed
+
+
+def claim(event_id):
+    """第一次看到這個事件回傳 True；已處理過（LINE 重送）則回傳 False"""
+    return event_id in claim_many([event_id])
+
+
+def release(event_id):
+    """處理失敗時釋放，讓 LINE 重送的事件可以再處理一次"""
+    with _lock:
+        _recent.pop(event_id, None)
+    ProcessedEvent.objects.filter(event_id=event_id).delete()
+
+
+def release_events(events):
+    for event in events:
+        event_id = event_id_of(event)
+        if event_id:
+            release(event_id)
+
+
+def event_id_of(event):
+    if isinstance(event, dict):
+        return event.get('webhookEventId')
+    return getattr(event, 'webhook_event_id', None)
+
+
+def filter_new_events(events):
+    """濾掉已處理過的事件；沒有 webhookEventId 的事件一律保留"""
+    claimed = claim_many([event_id for event_id in map(event_id_of, events) if event_id])
+    new_events = []
+    for event in events:
+        event_id = event_id_of(event)
+        if not event_id:
+            new_events.append(event)
+        elif event_id in claimed:
+            claimed.discard(event_id)  # 同一批出現兩次時只處理一次
+            new_events.append(event)
+    return new_events
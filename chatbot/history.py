@@ -0,0 +1,208 @@
+# chatbot/history.py
+# 依 token 預算組出對話紀錄：視窗從摘要之後開始、只在尾端增加，
+# 超出預算的舊訊息以每個 session 一份的滾動摘要代替，摘要只針對新滑出視窗的訊息增量更新。
+# /history 的分頁也在這裡：以 (timestamp, id) 做 keyset 分頁，渲染好的頁面存在共用快取。
+import re
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Q
+
+from .line_client import split_text
+from .models import Message, SessionSummary
+
+CJK_CHAR = re.compile(r'[\u3000-\u9fff\uac00-\ud7af\uff00-\uffef]')
+
+SUMMARY_PROMPT = (
+    '你會收到一段對話的既有摘要與後續的對話內容，'
+    '請整合成一份新的摘要，保留使用者的需求、重要事實與尚未完成的事項，不超過 200 字，使用 zh-tw。'
+)
+
+
+def count_tokens(text):
+    """估算 token 數：中日韓文字約一字一個 token，其餘約四個字元一個 token"""
+    cjk = len(CJK_CHAR.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4 + 4  # 每則訊息另有固定的格式開銷
+
+
+class HistoryWindow:
+    """放進 prompt 的對話紀錄範圍"""
+
+    def __init__(self, history=None, start_id=None, truncated=False, summary=None):
+        self.history = history or []
+        self.start_id = start_id  # 視窗內最舊一則訊息的 id
+        self.truncated = truncated  # 是否還有更舊的訊息沒有放進視窗
+        self.summary = summary
+
+
+def _tokens(row):
+    return row['token_count'] or count_tokens(row['content'])
+
+
+def _shift_start(tail, budget, complete):
+    """超出預算時把視窗起點往後移：留下放得進預算的最新訊息，而且移出的訊息至少有 LINEBOT_SUMMARY_TRIGGER_TOKENS，
+    這一輪回覆後摘要就會更新到新的起點"""
+    start = len(tail)
+    used = 0
+    while start > 0 and used + _tokens(tail[start - 1]) <= budget:
+        start -= 1
+        used += _tokens(tail[start])
+
+    if complete:
+        dropped = sum(_tokens(row) for row in tail[:start])
+        while start < len(tail) - 1 and dropped < settings.LINEBOT_SUMMARY_TRIGGER_TOKENS:
+            dropped += _tokens(tail[start])
+            start += 1
+    return tail[start:]
+
+
+def get_history_window(user_id, session_id, budget=None):
+    """取出放進 prompt 的對話紀錄；有訊息被排除時一併載入該 session 的摘要
+
+    視窗固定從摘要涵蓋的最後一則之後（還沒有摘要時從 session 的第一則）開始，每一輪只在尾端增加，
+    前綴保持不變，可以命中 OpenAI 的 prompt 快取；超出預算時起點才往後移，並在同一輪更新摘要，
+    所以起點只在摘要前進時移動。
+    """
+    budget = budget or settings.LINEBOT_HISTORY_TOKEN_BUDGET
+    fetch_limit = settings.LINEBOT_HISTORY_FETCH_LIMIT
+    rows = list(
+        Message.objects
+        .filter(user_id=user_id, session_id=session_id)
+        .order_by('-timestamp', '-id')
+        .values('id', 'role', 'content', 'token_count')[:fetch_limit]
+    )
+    rows.reverse()
+    complete = len(rows) < fetch_limit  # 已取出 session 的所有訊息
+
+    window = HistoryWindow()
+    if complete and sum(_tokens(row) for row in rows) <= budget:
+        included = rows
+    else:
+        window.truncated = True
+        window.summary = SessionSummary.objects.filter(session_id=session_id).first()
+        # 已經摘要過的訊息不再重複放入
+        covered_until_id = window.summary.covered_until_id if window.summary else 0
+        tail = [row for row in rows if row['id'] > covered_until_id]
+        complete = complete or len(tail) < len(rows)
+        if complete and sum(_tokens(row) for row in tail) <= budget:
+            included = tail
+        else:
+            included = _shift_start(tail, budget, complete)
+
+    window.history = [{'role': row['role'], 'content': row['content']} for row in included]
+    window.start_id = included[0]['id'] if included else None
+    return window
+
+
+def summary_message(window):
+    if window.summary and window.summary.summary:
+        return {'role': 'system', 'content': f"先前對話的摘要：{window.summary.summary}"}
+    return None
+
+
+def pending_summary_request(user_id, session_id, window):
+    """找出已滑出視窗、還沒摘要的訊息；累積超過門檻時回傳要送給 LLM 的摘要請求，否則回傳 None"""
+    if not window.truncated or not settings.LINEBOT_SUMMARY_TRIGGER_TOKENS:
+        return None
+
+    covered_until_id = window.summary.covered_until_id if window.summary else 0
+    pending = (
+        Message.objects
+        .filter(user_id=user_id, session_id=session_id, id__gt=covered_until_id)
+        .order_by('id')
+        .values('id', 'role', 'content', 'token_count')
+    )
+    if window.start_id:
+        pending = pending.filter(id__lt=window.start_id)
+    pending = list(pending[:settings.LINEBOT_HISTORY_FETCH_LIMIT])
+
+    if sum(_tokens(row) for row in pending) < settings.LINEBOT_SUMMARY_TRIGGER_TOKENS:
+        return None
+
+    transcript = '\n'.join(f"[{row['role']}] {row['content']}" for row in pending)
+    previous = window.summary.summary if window.summary else '（無）'
+    messages = [
+        {'role': 'system', 'content': SUMMARY_PROMPT},
+        {'role': 'user', 'content': f"既有摘要：\n{previous}\n\n後續對話：\n{transcript}"},
+    ]
+    return messages, pending[-1]['id']
+
+
+def store_summary(user_id, session_id, summary, covered_until_id):
+    SessionSummary.objects.update_or_create(
+        session_id=session_id,
+        defaults={
+            'user_id': user_id,
+            'summary': summary,
+            'covered_until_id': covered_until_id,
+            'token_count': count_tokens(summary),
+        },
+    )
+
+
+HISTORY_PAGE_PREFIX = 'history_page:'
+
+
+def _page_key(session_id, message_count, page):
+    # key 含 session 的訊息數，session 有新訊息時自然換成新的 key，不需要另外清除快取
+    return f"{HISTORY_PAGE_PREFIX}{session_id}:{message_count}:{page}"
+
+
+def _fetch_page(user_id, session_id, cursor):
+    """取出 cursor（上一頁最舊一則的 (timestamp, id)）之前的一頁訊息，回傳 (由舊到新的訊息, 下一頁的 cursor 或 None)"""
+    page_size = settings.LINEBOT_HISTORY_PAGE_SIZE
+    rows = Message.objects.filter(user_id=user_id, session_id=session_id)
+    if cursor:
+        timestamp, message_id = cursor
+        rows = rows.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=message_id))
+    rows = list(rows.order_by('-timestamp', '-id').values('id', 'role', 'content', 'timestamp')[:page_size + 1])
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = (rows[-1]['timestamp'], rows[-1]['id'])
+    rows.reverse()
+    return rows, next_cursor
+
+
+def _render_page(rows, page, has_more):
+    lines = [f"最近的對話紀錄（第 {page} 頁）：", '']
+    lines += [f"[{row['role']}] {row['content']}" for row in rows]
+    if has_more:
+        lines += ['', f"輸入 /history {page + 1} 查看更早的紀錄"]
+    # LINE 一次最多 5 則、每則 5000 字，超出的部分截斷
+    return split_text('\n'.join(lines))
+
+
+def render_history_page(user_id, session_id, message_count, page=1):
+    """回傳 /history 第 page 頁（第 1 頁為最新）要送出的文字 list，沒有這一頁時回傳空 list"""
+    if not session_id or not message_count or (page - 1) * settings.LINEBOT_HISTORY_PAGE_SIZE >= message_count:
+        return []
+
+    shared_cache = caches['shared']
+    cached = shared_cache.get(_page_key(session_id, message_count, page))
+    if cached is not None:
+        return cached['parts']
+
+    # 從最近一個有快取的前一頁接著往前翻，都沒有快取時從第 1 頁開始
+    start, cursor = 1, None
+    for previous in range(page - 1, 0, -1):
+        rendered = shared_cache.get(_page_key(session_id, message_count, previous))
+        if rendered is not None:
+            if rendered['next_cursor'] is None:
+                return []
+            start, cursor = previous + 1, rendered['next_cursor']
+            break
+
+    for current in range(start, page + 1):
+        rows, next_cursor = _fetch_page(user_id, session_id, cursor)
+        if not rows:
+            return []
+        rendered = {'parts': _render_page(rows, current, next_cursor is not None), 'next_cursor': next_cursor}
+        shared_cache.set(
+            _page_key(session_id, message_count, current), rendered, timeout=settings.LINEBOT_HISTORY_PAGE_CACHE_TTL
+        )
+        if next_cursor is None and current < page:
+            return []
+        cursor = next_cursor
+    return rendered['parts']
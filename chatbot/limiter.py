@@ -0,0 +1,127 @@
+# chatbot/limiter.py
+# OpenAI 呼叫的流量控制：
+# - 每位使用者同時只跑一個 LLM 回合（single-flight）：以 LineUser.llm_busy_until 的條件式 UPDATE 取得，
+#   期間新進的訊息先存成 DeferredMessage 並標記 LineUser.llm_deferred，目前這輪結束後合併成一輪回答
+# - debounce：短時間內連續傳來的訊息同樣先暫存，等待期間沒有新訊息才合併成一輪回答
+# - 全域 token bucket（存在資料庫，所有 worker 共用），額度用完時回覆請使用者稍後再試
+# 一般情況（沒有暫存訊息）每個回合只需要取得、釋放與取額度三個 UPDATE。
+import asyncio
+import time
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q, Value
+from django.db.models.functions import Greatest, Least
+from django.db.models.lookups import GreaterThanOrEqual
+from django.utils import timezone
+
+from .models import DeferredMessage, LineUser, RateLimitBucket
+
+OPENAI_BUCKET = 'openai'
+BUSY_REPLY = '目前使用的人比較多，請稍等一下再傳一次訊息～'
+
+
+def acquire_user(user_id):
+    """取得使用者的 LLM 回合鎖，已有回合在進行時回傳 False；worker 中斷時鎖在 LINEBOT_USER_LOCK_TIMEOUT 秒後失效"""
+    now = timezone.now()
+    return bool(
+        LineUser.objects
+        .filter(Q(llm_busy_until__isnull=True) | Q(llm_busy_until__lt=now), pk=user_id)
+        .update(llm_busy_until=now + timedelta(seconds=settings.LINEBOT_USER_LOCK_TIMEOUT))
+    )
+
+
+def release_user(user_id):
+    """釋放回合鎖；回合期間有訊息暫存時清除標記並回傳 True，呼叫端接著回答暫存的訊息"""
+    if LineUser.objects.filter(pk=user_id, llm_deferred=False).update(llm_busy_until=None):
+        return False
+    LineUser.objects.filter(pk=user_id).update(llm_busy_until=None, llm_deferred=False)
+    return True
+
+
+def defer_message(user_id, content, reply_token):
+    deferred = DeferredMessage.objects.create(user_id=user_id, content=content, reply_token=reply_token or '')
+    # 持有回合鎖的請求釋放時會看到這個標記
+    LineUser.objects.filter(pk=user_id).update(llm_deferred=True)
+    return deferred
+
+
+def is_latest_deferred(deferred):
+    """暫存之後這位使用者沒有再傳新訊息"""
+    return not DeferredMessage.objects.filter(user_id=deferred.user_id, id__gt=deferred.id).exists()
+
+
+def has_deferred(user_id):
+    return DeferredMessage.objects.filter(user_id=user_id).exists()
+
+
+def pop_deferred(user_id):
+    """取出並刪除暫存的訊息，回傳 (訊息內容 list, 仍可使用的 reply token 或 None, 最後一則的收到時間 epoch 秒)"""
+    with transaction.atomic():
+        deferred = list(DeferredMessage.objects.filter(user_id=user_id).order_by('id'))
+        DeferredMessage.objects.filter(id__in=[d.id for d in deferred]).delete()
+
+    if not deferred:
+        return [], None, None
+
+    latest = deferred[-1]
+    age = (timezone.now() - latest.created_at).total_seconds()
+    reply_token = latest.reply_token if latest.reply_token and age < settings.LINEBOT_REPLY_TOKEN_TTL else None
+    return [d.content for d in deferred], reply_token, latest.created_at.timestamp()
+
+
+def try_take_token(name=OPENAI_BUCKET):
+    """從 token bucket 取一個額度，回傳 (是否取得, 還需等待的秒數)"""
+    rate = settings.LINEBOT_OPENAI_RPM / 60
+    capacity = settings.LINEBOT_OPENAI_BURST or settings.LINEBOT_OPENAI_RPM
+    now = time.time()
+
+    # 補充與扣除在同一個條件式 UPDATE 完成，不需要先鎖住再讀取這一列
+    tokens = Least(
+        Value(float(capacity)), F('tokens') + Greatest(Value(now) - F('updated_at'), Value(0.0)) * Value(rate)
+    )
+    if RateLimitBucket.objects.filter(GreaterThanOrEqual(tokens, 1), name=name).update(
+        tokens=tokens - 1, updated_at=now
+    ):
+        return True, 0
+
+    # 額度不足或第一次使用：讀取目前的額度計算要等多久
+    bucket, created = RateLimitBucket.objects.get_or_create(
+        name=name, defaults={'tokens': capacity - 1, 'updated_at': now}
+    )
+    if created:
+        return True, 0
+    tokens = min(capacity, bucket.tokens + max(now - bucket.updated_at, 0) * rate)
+    return False, max(1 - tokens, 0) / rate
+
+
+def take_llm_token():
+    """取得一次 OpenAI 呼叫的額度，最多等待 LINEBOT_RATE_LIMIT_WAIT 秒；LINEBOT_OPENAI_RPM=0 時不限制"""
+    if not settings.LINEBOT_OPENAI_RPM:
+        return True
+
+    deadline = time.monotonic() + settings.LINEBOT_RATE_LIMIT_WAIT
+    while True:
+        taken, wait = try_take_token()
+        if taken:
+            return True
+        if time.monotonic() + wait > deadline:
+            return False
+        time.sleep(wait)
+
+
+async def atake_llm_token():
+    """take_llm_token 的非同步版本，等待時不佔住 event loop"""
+    if not settings.LINEBOT_OPENAI_RPM:
+        return True
+
+    deadline = time.monotonic() + settings.LINEBOT_RATE_LIMIT_WAIT
+    while True:
+        taken, wait = await sync_to_async(try_take_token)()
+        if taken:
+            return True
+        if time.monotonic() + wait > deadline:
+            return False
+        await asyncio.sleep(wait)
@@ -0,0 +1,304 @@
+# chatbot/line_client.py
+# 所有對 LINE API 的對外呼叫都走這裡：共用連線池、keep-alive、逾時與有限次數重試
+import asyncio
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+
+import aiohttp
+import requests
+from django.conf import settings
+from linebot import AsyncLineBotApi, LineBotApi
+from linebot.aiohttp_async_http_client import AiohttpAsyncHttpClient, AiohttpAsyncHttpResponse
+from linebot.http_client import RequestsHttpClient, RequestsHttpResponse
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+LINE_CHANNEL_ACCESS_TOKEN = os.getenv('LINE_CHANNEL_ACCESS_TOKEN')
+LOADING_URL = "https://api.line.me/v2/bot/chat/loading/start"
+
+# LINE 限制：一次 reply / push 最多 5 則訊息，每則文字最多 5000 字
+MAX_MESSAGES_PER_REQUEST = 5
+TEXT_MESSAGE_LIMIT = 5000
+LOADING_STOP_TIMEOUT = 1  # 停止思考動畫時最多等待送出中的請求幾秒
+
+HTTP_TIMEOUT = (settings.LINEBOT_HTTP_CONNECT_TIMEOUT, settings.LINEBOT_HTTP_READ_TIMEOUT)
+
+
+class PostSafeRetry(Retry):
+    """reply / push 都是 POST，不是冪等的：5xx 或讀取逾時時 LINE 可能已經送出訊息，重送會重複推播或重用 reply token。
+    POST 只在連線建立失敗（請求還沒送出）與 429（LINE 沒有處理）時重試，其他 method 照一般規則。"""
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if method and method.upper() == 'POST':
+            return status_code == 429
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+def _build_session():
+    # 預設的 allowed_methods 不含 POST，POST 讀取逾時時不會重送
+    retry = PostSafeRetry(
+        total=settings.LINEBOT_HTTP_RETRIES,
+        backoff_factor=settings.LINEBOT_HTTP_BACKOFF,
+        status_forcelist=(429, 500, 502, 503, 504),
+        other=0,  # 其他錯誤可能發生在請求送出之後
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=settings.LINEBOT_HTTP_POOL_SIZE,
+        pool_maxsize=settings.LINEBOT_HTTP_POOL_SIZE,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+session = _build_session()
+
+
+class SessionHttpClient(RequestsHttpClient):
+    """讓 LineBotApi 共用同一個 requests.Session（連線池 + keep-alive）"""
+
+    def get(self, url, headers=None, params=None, stream=False, timeout=None):
+        response = session.get(
+            url, headers=headers, params=params, stream=stream, timeout=timeout or self.timeout
+        )
+        return RequestsHttpResponse(response)
+
+    def post(self, url, headers=None, data=None, timeout=None):
+        response = session.post(url, headers=headers, data=data, timeout=timeout or self.timeout)
+        return RequestsHttpResponse(response)
+
+    def delete(self, url, headers=None, data=None, timeout=None):
+        response = session.delete(url, headers=headers, data=data, timeout=timeout or self.timeout)
+        return RequestsHttpResponse(response)
+
+    def put(self, url, headers=None, data=None, timeout=None):
+        response = session.put(url, headers=headers, data=data, timeout=timeout or self.timeout)
+        return RequestsHttpResponse(response)
+
+
+def split_text(text, limit=TEXT_MESSAGE_LIMIT, max_parts=MAX_MESSAGES_PER_REQUEST):
+    """把文字切成最多 max_parts 段、每段不超過 limit 字，盡量在換行處切開；超出的部分截斷"""
+    parts = []
+    while text and len(parts) < max_parts:
+        if len(text) <= limit:
+            parts.append(text)
+            break
+        cut = text.rfind('\n', 0, limit)
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip('\n')
+    return parts
+
+
+line_bot_api = LineBotApi(LINE_CHANNEL_ACCESS_TOKEN, timeout=HTTP_TIMEOUT, http_client=SessionHttpClient)
+
+
+def push(user_id, messages):
+    """push message 帶 retry key，同一個 key LINE 只會送出一次，不會因重試重複推播"""
+    line_bot_api.push_message(user_id, messages, retry_key=uuid.uuid4().hex)
+
+
+def reply_or_push(reply_token, user_id, messages):
+    """有 reply token 時用 reply，沒有（已過期）時改用 push message"""
+    if reply_token:
+        line_bot_api.reply_message(reply_token, messages)
+    else:
+        push(user_id, messages)
+
+
+def _loading_request(chat_id, seconds):
+    headers = {
+        "Authorization": f"Bearer {LINE_CHANNEL_ACCESS_TOKEN}",
+        "Content-Type": "application/json"
+    }
+    payload = {
+        "chatId": chat_id,
+        "loadingSeconds": seconds
+    }
+    return headers, payload
+
+
+def send_loading(chat_id, seconds):
+    headers, payload = _loading_request(chat_id, seconds)
+    try:
+        response = session.post(LOADING_URL, headers=headers, json=payload, timeout=HTTP_TIMEOUT)
+        if response.status_code != 200:
+            print(f"[!] send_loading 失敗：{response.status_code} - {response.text}")
+    except Exception as e:
+        print(f"[!] send_loading 發生錯誤：{str(e)}")
+
+
+def _loading_interval(seconds):
+    # 動畫結束前一秒再送一次，讓長時間的生成不會出現空檔
+    return max(seconds - 1, 1)
+
+
+class LoadingIndicator:
+    """在背景執行緒送出思考動畫，執行超過 loadingSeconds 時自動延長。
+
+    送出回覆前必須先 stop()：等送出中的 loading 請求結束（最多 LOADING_STOP_TIMEOUT 秒），
+    請求晚於回覆到達 LINE 時，動畫會在回覆之後再出現 loadingSeconds 秒。
+    """
+
+    def __init__(self, chat_id, seconds=None):
+        self.chat_id = chat_id
+        self.seconds = seconds or settings.LINEBOT_LOADING_SECONDS
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None and not self._stop.is_set():
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            send_loading(self.chat_id, self.seconds)
+            if self._stop.wait(_loading_interval(self.seconds)):
+                break
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(LOADING_STOP_TIMEOUT)
+
+
+@contextmanager
+def loading_indicator(chat_id, seconds=None):
+    """區塊執行期間顯示思考動畫，離開區塊時停止"""
+    indicator = LoadingIndicator(chat_id, seconds)
+    indicator.start()
+    try:
+        yield indicator
+    finally:
+        indicator.stop()
+
+
+# aiohttp session 必須在 event loop 內建立，第一次使用時才初始化
+# 與 PostSafeRetry 相同：只有請求確定還沒送出（連線建立失敗或逾時）時才重試 POST
+ASYNC_RETRY_ERRORS = (aiohttp.ClientConnectorError, aiohttp.ConnectionTimeoutError)
+
+
+def _retry_delay(attempt, response=None):
+    """有 Retry-After 時照 LINE 指定的秒數，否則指數退避"""
+    retry_after = response.headers.get('Retry-After', '') if response is not None else ''
+    if retry_after.isdigit():
+        return float(retry_after)
+    return settings.LINEBOT_HTTP_BACKOFF * 2 ** attempt
+
+
+async def _apost(post, *args, **kwargs):
+    """以 aiohttp 送出 POST，連線失敗與 429 時最多重試 LINEBOT_HTTP_RETRIES 次，回傳最後一次的回應"""
+    retries = settings.LINEBOT_HTTP_RETRIES
+    for attempt in range(retries + 1):
+        try:
+            response = await post(*args, **kwargs)
+        except ASYNC_RETRY_ERRORS:
+            if attempt == retries:
+                raise
+            await asyncio.sleep(_retry_delay(attempt))
+            continue
+
+        if response.status != 429 or attempt == retries:
+            return response
+        delay = _retry_delay(attempt, response)
+        response.release()
+        await asyncio.sleep(delay)
+
+
+class RetryingAiohttpClient(AiohttpAsyncHttpClient):
+    """AsyncLineBotApi 的 reply / push 也套用 _apost 的重試規則"""
+
+    async def post(self, url, headers=None, data=None, timeout=None):
+        response = await _apost(
+            self.session.post, url, headers=headers, data=data, timeout=timeout or self.timeout
+        )
+        return AiohttpAsyncHttpResponse(response)
+
+
+_aiohttp_session = None
+_async_line_bot_api = None
+
+
+def get_aiohttp_session():
+    global _aiohttp_session, _async_line_bot_api
+    if _aiohttp_session is None or _aiohttp_session.closed:
+        timeout = aiohttp.ClientTimeout(
+            sock_connect=settings.LINEBOT_HTTP_CONNECT_TIMEOUT,
+            sock_read=settings.LINEBOT_HTTP_READ_TIMEOUT,
+        )
+        _aiohttp_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=settings.LINEBOT_HTTP_POOL_SIZE),
+            timeout=timeout,
+        )
+        _async_line_bot_api = AsyncLineBotApi(
+            LINE_CHANNEL_ACCESS_TOKEN, RetryingAiohttpClient(_aiohttp_session, timeout=timeout)
+        )
+    return _aiohttp_session
+
+
+def get_async_line_bot_api():
+    get_aiohttp_session()
+    return _async_line_bot_api
+
+
+async def apush(user_id, messages):
+    """push 帶 retry key；RetryingAiohttpClient 重試時送出相同的 key，LINE 只會送出一次"""
+    await get_async_line_bot_api().push_message(user_id, messages, retry_key=uuid.uuid4().hex)
+
+
+async def areply_or_push(reply_token, user_id, messages):
+    if reply_token:
+        await get_async_line_bot_api().reply_message(reply_token, messages)
+    else:
+        await apush(user_id, messages)
+
+
+async def asend_loading(chat_id, seconds):
+    headers, payload = _loading_request(chat_id, seconds)
+    try:
+        response = await _apost(get_aiohttp_session().post, LOADING_URL, headers=headers, json=payload)
+        async with response:
+            if response.status != 200:
+                print(f"[!] send_loading 失敗：{response.status} - {await response.text()}")
+    except Exception as e:
+        print(f"[!] send_loading 發生錯誤：{str(e)}")
+
+
+class AsyncLoadingIndicator:
+    """LoadingIndicator 的非同步版本，以背景 task 送出並延長思考動畫"""
+
+    def __init__(self, chat_id, seconds=None):
+        self.chat_id = chat_id
+        self.seconds = seconds or settings.LINEBOT_LOADING_SECONDS
+        self._stop = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        if self._task is None and not self._stop.is_set():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while not self._stop.is_set():
+            await asend_loading(self.chat_id, self.seconds)
+            try:
+                await asyncio.wait_for(self._stop.wait(), _loading_interval(self.seconds))
+            except asyncio.TimeoutError:
+                pass
+
+    async def stop(self):
+        self._stop.set()
+        if self._task is None or self._task.done():
+            return
+        # 等送出中的 loading 請求結束，逾時才取消
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), LOADING_STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            self._task.cancel()
@@ -0,0 +1,146 @@
+# chatbot/llm_backends.py
+# LLM 後端：openai（官方 API）、compatible（OpenAI 相容的 base URL，例如自架的模型或壓測用的 stub server）、
+# fake（在 process 內模擬延遲與吐字速度，不需要網路也不花費用，用來壓測完整的 webhook 流程）。
+# 預設後端由 LINEBOT_LLM_BACKEND 決定，SystemPromptRule 可以另外指定後端與模型。
+import asyncio
+import os
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+import openai
+from django.conf import settings
+
+from .history import count_tokens
+
+class OpenAIBackend:
+    """OpenAI 官方或相容 API；重試由 llm_gateway 控制，關閉 SDK 內建的重試"""
+
+    def __init__(self, name, api_key=None, base_url=None):
+        self.name = name
+        self.client = openai.OpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+        self.async_client = openai.AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+
+    def create(self, **kwargs):
+        return self.client.chat.completions.create(**kwargs)
+
+    async def acreate(self, **kwargs):
+        return await self.async_client.chat.completions.create(**kwargs)
+
+
+class FakeBackend:
+    """模擬的 LLM：首字延遲為對數常態分布，之後依每秒 token 數吐出固定長度的回覆"""
+
+    name = 'fake'
+
+    def __init__(self, latency=None, latency_sigma=None, tokens_per_second=None, reply_tokens=None):
+        self.latency = settings.LINEBOT_FAKE_LLM_LATENCY if latency is None else latency
+        self.latency_sigma = settings.LINEBOT_FAKE_LLM_LATENCY_SIGMA if latency_sigma is None else latency_sigma
+        self.tokens_per_second = tokens_per_second or settings.LINEBOT_FAKE_LLM_TOKENS_PER_SECOND
+        self.reply_tokens = reply_tokens or settings.LINEBOT_FAKE_LLM_REPLY_TOKENS
+
+    def _first_token_delay(self):
+        if self.latency <= 0:
+            return 0
+        return random.lognormvariate(0, self.latency_sigma) * self.latency
+
+    def _usage(self, messages):
+        prompt_tokens = sum(count_tokens(m['content']) for m in messages)
+        return SimpleNamespace(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=self.reply_tokens,
+            total_tokens=prompt_tokens + self.reply_tokens,
+            prompt_tokens_details=SimpleNamespace(cached_tokens=0),
+        )
+
+    def _tokens(self):
+        # 一個中文字約一個 token
+        return ['模擬回覆。' if i % 5 == 4 else '字' for i in range(self.reply_tokens)]
+
+    def _response(self, messages):
+        message = SimpleNamespace(role='assistant', content=''.join(self._tokens()))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=self._usage(messages))
+
+    def _chunk(self, content=None, usage=None):
+        choices = [SimpleNamespace(delta=SimpleNamespace(content=content))] if content is not None else []
+        return SimpleNamespace(choices=choices, usage=usage)
+
+    def _stream(self, messages, include_usage):
+        time.sleep(self._first_token_delay())
+        for token in self._tokens():
+            yield self._chunk(token)
+            time.sleep(1 / self.tokens_per_second)
+        if include_usage:
+            yield self._chunk(usage=self._usage(messages))
+
+    async def _astream(self, messages, include_usage):
+        await asyncio.sleep(self._first_token_delay())
+        for token in self._tokens():
+            yield self._chunk(token)
+            await asyncio.sleep(1 / self.tokens_per_second)
+        if include_usage:
+            yield self._chunk(usage=self._usage(messages))
+
+    def _generation_time(self):
+        return self._first_token_delay() + self.reply_tokens / self.tokens_per_second
+
+    def create(self, model, messages, stream=False, stream_options=None, timeout=None, **kwargs):
+        include_usage = bool(stream_options and stream_options.get('include_usage'))
+        if stream:
+            return self._stream(messages, include_usage)
+        time.sleep(self._generation_time())
+        return self._response(messages)
+
+    async def acreate(self, model, messages, stream=False, stream_options=None, timeout=None, **kwargs):
+        include_usage = bool(stream_options and stream_options.get('include_usage'))
+        if stream:
+            return self._astream(messages, include_usage)
+        await asyncio.sleep(self._generation_time())
+        return self._response(messages)
+
+
+_lock = threading.Lock()
+_backends = {}
+
+
+def _build(name):
+    if name == 'openai':
+        return OpenAIBackend(name, api_key=os.getenv('OPENAI_API_KEY'))
+    if name == 'compatible':
+        return OpenAIBackend(
+            name,
+            api_key=settings.LINEBOT_LLM_COMPATIBLE_API_KEY or os.getenv('OPENAI_API_KEY'),
+            base_url=settings.LINEBOT_LLM_COMPATIBLE_BASE_URL,
+        )
+    if name == 'fake':
+        return FakeBackend()
+    raise ValueError(f"未知的 LLM 後端：{name}")
+
+
+def get_backend(name=None):
+    """依名稱取得後端（每個 process 各建立一次）；沒有指定時使用 LINEBOT_LLM_BACKEND"""
+    name = name or settings.LINEBOT_LLM_BACKEND
+    backend = _backends.get(name)
+    if backend is None:
+        with _lock:
+            backend = _backends.get(name)
+            if backend is None:
+                backend = _backends[name] = _build(name)
+    return backend
+
+
+def register_backend(name, backend):
+    """替換或新增後端（例如壓測時使用自訂參數的 FakeBackend）"""
+    with _lock:
+        _backends[name] = backend
+
+
+def resolve(system_prompt_rule=None):
+    """回傳這一輪要使用的 (後端名稱, 模型)：規則有指定時優先，否則使用設定的預設值"""
+    backend = settings.LINEBOT_LLM_BACKEND
+    model = settings.LINEBOT_LLM_MODEL
+    if system_prompt_rule is not None:
+        backend = system_prompt_rule.llm_backend or backend
+        model = system_prompt_rule.llm_model or model
+    return backend, model
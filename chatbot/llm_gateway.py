@@ -0,0 +1,181 @@
+# chatbot/llm_gateway.py
+# 所有 OpenAI 呼叫都走這裡：
+# - 每次呼叫都有期限（reply token 還有效時以它的有效時間為準），逾時不再重試
+# - 可重試的錯誤（連線、逾時、429、5xx）以隨機抖動的指數退避重試
+# - 斷路器：各後端的各模型在時間窗內錯誤率過高時暫停使用，改用備援模型。
+#   錯誤率以各 process 自己的時間窗計算（不查詢資料庫）；跳脫時把暫停到的時間寫入共用快取，
+#   其他 worker 每 CIRCUIT_CHECK_INTERVAL 秒讀取一次，一起暫停
+import asyncio
+import random
+import threading
+import time
+
+import openai
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+
+from . import metrics
+from .llm_backends import get_backend
+
+CIRCUIT_PREFIX = 'llm_circuit:'
+CIRCUIT_CHECK_INTERVAL = 5  # 多久讀取一次其他 worker 的跳脫狀態（秒）
+MIN_TIMEOUT = 1.0  # 剩餘時間少於此值時不再送出請求
+
+RETRIABLE_ERRORS = (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
+
+_lock = threading.Lock()
+_windows = {}  # 斷路器名稱 -> [時間窗編號, 呼叫次數, 錯誤次數]
+_open_until = {}  # 斷路器名稱 -> 暫停到的時間（epoch 秒）
+_checked_at = {}  # 斷路器名稱 -> 上次讀取共用快取的時間
+
+
+class LLMUnavailableError(Exception):
+    """主要與備援模型都無法使用，或期限內沒有成功"""
+
+
+def deadline_for():
+    """沒有 reply token 限制時，這次呼叫的期限（epoch 秒）"""
+    return time.time() + settings.LINEBOT_LLM_TIMEOUT
+
+
+def reply_deadline(reply_token=None, received_at=None):
+    """回傳 (仍可使用的 reply token 或 None, 這次呼叫的期限)
+
+    reply token 還有效時，期限不超過它的有效時間；已經過期（例如佇列積壓或 LINE 重送的舊事件）時捨棄 token，
+    使用完整的 LINEBOT_LLM_TIMEOUT，回覆改用 push message。
+    """
+    deadline = deadline_for()
+    if reply_token and received_at:
+        expires_at = received_at + settings.LINEBOT_REPLY_TOKEN_TTL
+        if expires_at - time.time() < MIN_TIMEOUT:
+            return None, deadline
+        deadline = min(deadline, expires_at)
+    return reply_token, deadline
+
+
+def circuit_name(backend, model):
+    return f"{backend.name}:{model}"
+
+
+def _count(name, error):
+    """記錄本 process 這個時間窗的呼叫結果，回傳 (呼叫次數, 錯誤次數)"""
+    window = int(time.time() // settings.LINEBOT_CIRCUIT_WINDOW)
+    with _lock:
+        counts = _windows.get(name)
+        if counts is None or counts[0] != window:
+            counts = _windows[name] = [window, 0, 0]
+        counts[1] += 1
+        counts[2] += error
+        return counts[1], counts[2]
+
+
+def is_open(name):
+    now = time.time()
+    with _lock:
+        if _open_until.get(name, 0) > now:
+            return True
+        if now - _checked_at.get(name, 0) < CIRCUIT_CHECK_INTERVAL:
+            return False
+        _checked_at[name] = now
+
+    # 其他 worker 跳脫時寫入的暫停時間
+    open_until = caches['shared'].get(CIRCUIT_PREFIX + name)
+    if open_until and open_until > now:
+        with _lock:
+            _open_until[name] = open_until
+        return True
+    return False
+
+
+def record_success(name):
+    _count(name, False)
+
+
+def record_failure(name):
+    calls, errors = _count(name, True)
+    if calls >= settings.LINEBOT_CIRCUIT_MIN_CALLS and errors / calls >= settings.LINEBOT_CIRCUIT_ERROR_RATE:
+        open_until = time.time() + settings.LINEBOT_CIRCUIT_COOLDOWN
+        with _lock:
+            if _open_until.get(name, 0) > time.time():
+                return
+            _open_until[name] = open_until
+            _windows.pop(name, None)  # 恢復後重新計算錯誤率
+        # add：多個 worker 同時判定時只記一次跳脫
+        if caches['shared'].add(CIRCUIT_PREFIX + name, open_until, timeout=settings.LINEBOT_CIRCUIT_COOLDOWN):
+            metrics.count('linebot_llm_circuit_trips_total', circuit=name)
+            print(f"[!] {name} 錯誤率過高（{errors}/{calls}），暫停 {settings.LINEBOT_CIRCUIT_COOLDOWN} 秒")
+
+
+def pick_model(backend, model):
+    """主要模型斷路時改用同一後端的備援模型；都不能用時拋出 LLMUnavailableError"""
+    if not is_open(circuit_name(backend, model)):
+        return model
+    fallback = settings.LINEBOT_LLM_FALLBACK_MODEL
+    if fallback and fallback != model and not is_open(circuit_name(backend, fallback)):
+        metrics.count('linebot_llm_fallbacks_total', circuit=circuit_name(backend, model))
+        return fallback
+    raise LLMUnavailableError(f"{circuit_name(backend, model)} 暫停使用中")
+
+
+def _backoff(attempt, deadline):
+    """隨機抖動的指數退避，超過期限時回傳 None"""
+    delay = random.uniform(0, settings.LINEBOT_LLM_RETRY_BACKOFF * 2 ** attempt)
+    if time.time() + delay + MIN_TIMEOUT > deadline:
+        return None
+    return delay
+
+
+def _remaining(deadline):
+    remaining = deadline - time.time()
+    if remaining < MIN_TIMEOUT:
+        raise LLMUnavailableError('超過回覆期限')
+    return remaining
+
+
+def chat(model, messages, deadline=None, backend=None, **kwargs):
+    """呼叫 chat completions，回傳 (response, 實際使用的模型)；stream=True 時 response 為串流"""
+    backend = get_backend(backend)
+    deadline = deadline or deadline_for()
+    attempt = 0
+    while True:
+        used_model = pick_model(backend, model)
+        try:
+            response = backend.create(model=used_model, messages=messages, timeout=_remaining(deadline), **kwargs)
+        except RETRIABLE_ERRORS as e:
+            metrics.count('linebot_llm_errors_total', circuit=circuit_name(backend, used_model), error=type(e).__name__)
+            record_failure(circuit_name(backend, used_model))
+            delay = _backoff(attempt, deadline) if attempt < settings.LINEBOT_LLM_RETRIES else None
+            if delay is None:
+                raise
+            print(f"[!] {used_model} 呼叫失敗，{delay:.1f} 秒後重試：{str(e)}")
+            time.sleep(delay)
+            attempt += 1
+            continue
+        record_success(circuit_name(backend, used_model))
+        return response, used_model
+
+
+async def achat(model, messages, deadline=None, backend=None, **kwargs):
+    """chat 的非同步版本；斷路器讀寫共用快取的部分以 sync_to_async 執行"""
+    backend = get_backend(backend)
+    deadline = deadline or deadline_for()
+    attempt = 0
+    while True:
+        used_model = await sync_to_async(pick_model)(backend, model)
+        try:
+            response = await backend.acreate(
+                model=used_model, messages=messages, timeout=_remaining(deadline), **kwargs
+            )
+        except RETRIABLE_ERRORS as e:
+            metrics.count('linebot_llm_errors_total', circuit=circuit_name(backend, used_model), error=type(e).__name__)
+            await sync_to_async(record_failure)(circuit_name(backend, used_model))
+            delay = _backoff(attempt, deadline) if attempt < settings.LINEBOT_LLM_RETRIES else None
+            if delay is None:
+                raise
+            print(f"[!] {used_model} 呼叫失敗，{delay:.1f} 秒後重試：{str(e)}")
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        record_success(circuit_name(backend, used_model))
+        return response, used_model
@@ -0,0 +1,147 @@
+import gzip
+import json
+import os
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from chatbot.models import LineUser, Message, SessionSummary
+from chatbot.retention import delete_in_chunks, process_purges
+
+ARCHIVE_FIELDS = (
+    'id', 'user_id', 'session_id', 'role', 'content', 'system_prompt_rule_id', 'timestamp',
+    'token_count', 'prompt_tokens', 'cached_tokens', 'completion_tokens', 'latency_ms',
+)
+
+
+class Command(BaseCommand):
+    help = '把最後一則訊息早於保留期限的 session 匯出成 gzip 壓縮的 JSONL，並從資料庫刪除'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.LINEBOT_ARCHIVE_AFTER_DAYS,
+                            help='最後一則訊息超過幾天的 session 要封存')
+        parser.add_argument('--output-dir', default=settings.LINEBOT_ARCHIVE_DIR, help='封存檔的目錄')
+        parser.add_argument('--batch-size', type=int, default=settings.LINEBOT_PURGE_CHUNK_SIZE,
+                            help='每次讀取與刪除的筆數')
+        parser.add_argument('--no-prune', action='store_true', help='只匯出，不刪除資料庫中的訊息')
+
+    def handle(self, *args, **options):
+        # 先補完 /reset 中斷時沒刪完的紀錄，不必封存
+        purged = process_purges()
+        if purged:
+            self.stdout.write(f"刪除 /reset 後尚未刪除的訊息：{purged} 筆")
+
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        # 只處理執行開始前已存在的訊息，執行期間新增的訊息不受影響
+        max_id = Message.objects.aggregate(last_id=Max('id'))['last_id']
+        if max_id is None:
+            self.stdout.write('沒有訊息需要封存')
+            return
+
+        os.makedirs(options['output_dir'], exist_ok=True)
+        path = os.path.join(
+            options['output_dir'], f"messages-{timezone.now().strftime('%Y%m%d-%H%M%S')}.jsonl.gz"
+        )
+        # 匯出的 session id 暫存在檔案，刪除時直接使用，不必再查詢一次，也不必全部放在記憶體
+        sessions_path = path + '.sessions'
+        batch_size = options['batch_size']
+
+        sessions = 0
+        archived = 0
+        with gzip.open(path, 'wt', encoding='utf-8') as archive, open(sessions_path, 'w') as session_file:
+            for session_ids in self.old_sessions(cutoff, batch_size):
+                sessions += len(session_ids)
+                session_file.writelines(f"{session_id.hex}\n" for session_id in session_ids)
+                for row in self.session_messages(session_ids, max_id, batch_size):
+                    archive.write(json.dumps(row, ensure_ascii=False, default=str) + '\n')
+                    archived += 1
+
+        if not archived:
+            os.remove(path)
+            os.remove(sessions_path)
+            self.stdout.write('沒有訊息需要封存')
+            return
+        self.stdout.write(f"已封存 {sessions} 個 session、{archived} 則訊息：{path}")
+
+        if options['no_prune']:
+            os.remove(sessions_path)
+            return
+
+        # 封存檔完整寫入後才刪除
+        deleted = 0
+        with open(sessions_path) as session_file:
+            for session_ids in self.read_batches(session_file, batch_size):
+                # 匯出之後又有新訊息的 session 保留
+                active = set(
+                    Message.objects
+                    .filter(session_id__in=session_ids, timestamp__gte=cutoff)
+                    .values_list('session_id', flat=True)
+                    .distinct()
+                )
+                session_ids = [session_id for session_id in session_ids if session_id not in active]
+                deleted += delete_in_chunks(
+                    Message.objects.filter(session_id__in=session_ids, id__lte=max_id), batch_size
+                )
+                delete_in_chunks(SessionSummary.objects.filter(session_id__in=session_ids), batch_size)
+                # 這些 session 若仍是使用者目前的 session，下一則訊息改為開始新的 session
+                LineUser.objects.filter(session_id__in=session_ids).update(
+                    session_id=None, system_prompt_rule=None, message_count=0
+                )
+        os.remove(sessions_path)
+        self.stdout.write(f"已從資料庫刪除 {deleted} 則訊息")
+
+    def old_sessions(self, cutoff, batch_size):
+        """依 session_id 順序產生最後一則訊息早於 cutoff 的 session id（每批 batch_size 個）；
+        以 keyset 分頁，每次只查詢上一批之後的 session"""
+        last_session_id = None
+        while True:
+            messages = Message.objects.all()
+            if last_session_id is not None:
+                messages = messages.filter(session_id__gt=last_session_id)
+            batch = list(
+                messages
+                .values('session_id')
+                .annotate(last_timestamp=Max('timestamp'))
+                .filter(last_timestamp__lt=cutoff)
+                .order_by('session_id')
+                .values_list('session_id', flat=True)[:batch_size]
+            )
+            if not batch:
+                return
+            yield batch
+            if len(batch) < batch_size:
+                return
+            last_session_id = batch[-1]
+
+    def session_messages(self, session_ids, max_id, batch_size):
+        """依 (session_id, timestamp, id) 順序分頁讀出這些 session 的訊息，每次最多 batch_size 筆"""
+        cursor = None
+        while True:
+            messages = Message.objects.filter(session_id__in=session_ids, id__lte=max_id)
+            if cursor:
+                session_id, timestamp, message_id = cursor
+                messages = messages.filter(
+                    Q(session_id__gt=session_id)
+                    | Q(session_id=session_id, timestamp__gt=timestamp)
+                    | Q(session_id=session_id, timestamp=timestamp, id__gt=message_id)
+                )
+            rows = list(messages.order_by('session_id', 'timestamp', 'id').values(*ARCHIVE_FIELDS)[:batch_size])
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            last = rows[-1]
+            cursor = (last['session_id'], last['timestamp'], last['id'])
+
+    def read_batches(self, session_file, batch_size):
+        batch = []
+        for line in session_file:
+            batch.append(uuid.UUID(line.strip()))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
@@ -0,0 +1,180 @@
+import base64
+import hashlib
+import hmac
+import json
+import resource
+import statistics
+import threading
+import time
+import tracemalloc
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from unittest import mock
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from chatbot import line_client
+from chatbot.llm_backends import FakeBackend, register_backend
+from chatbot.models import DeferredMessage, LineUser, Message, SessionSummary
+from chatbot.views import LINE_CHANNEL_SECRET, callback
+
+USER_PREFIX = 'Ubench'
+
+
+def sign(body):
+    digest = hmac.new(LINE_CHANNEL_SECRET.encode('utf-8'), body.encode('utf-8'), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode('utf-8')
+
+
+def webhook_body(user_id, *texts):
+    """同一位使用者的文字訊息事件，多則時放在同一個 webhook"""
+    events = [
+        {
+            'type': 'message',
+            'mode': 'active',
+            'timestamp': int(time.time() * 1000),
+            'source': {'type': 'user', 'userId': user_id},
+            'webhookEventId': uuid.uuid4().hex,
+            'deliveryContext': {'isRedelivery': False},
+            'replyToken': uuid.uuid4().hex,
+            'message': {'id': uuid.uuid4().hex, 'type': 'text', 'quoteToken': 'bench', 'text': text},
+        }
+        for text in texts
+    ]
+    return json.dumps({'destination': 'bench', 'events': events})
+
+
+def percentile(values, pct):
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[pct - 1]
+
+
+class Command(BaseCommand):
+    help = '以簽章正確的 webhook 壓測 chatbot.views.callback（LINE 與 OpenAI 皆為模擬），回報延遲、吞吐量、查詢數與記憶體'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20, help='模擬的使用者數量')
+        parser.add_argument('--messages', type=int, default=5, help='每位使用者依序傳送的訊息數')
+        parser.add_argument('--concurrency', type=int, default=8, help='同時送出 webhook 的使用者數量')
+        parser.add_argument('--llm-latency', type=float, default=0.2, help='模擬 LLM 首字延遲的中位數（秒）')
+        parser.add_argument('--llm-tokens-per-second', type=float, default=200, help='模擬 LLM 每秒吐出的 token 數')
+        parser.add_argument('--rate-limit', action='store_true', help='套用 LINEBOT_OPENAI_RPM（預設壓測時不限制）')
+        parser.add_argument('--keep', action='store_true', help='保留壓測產生的資料（預設結束後刪除）')
+        parser.add_argument('--allow-production', action='store_true',
+                            help='DEBUG=False（正式站設定）時仍然執行；壓測會寫入並刪除目前設定的資料庫')
+
+    def handle(self, *args, **options):
+        # 壓測會在目前的資料庫建立並刪除使用者與訊息，正式站設定下必須明確指定才執行
+        if not settings.DEBUG and not options['allow_production']:
+            raise CommandError(
+                f"DEBUG=False，目前的資料庫是 {connection.settings_dict['NAME']}；"
+                '壓測會寫入這個資料庫，確定要執行請加上 --allow-production'
+            )
+
+        register_backend('fake', FakeBackend(
+            latency=options['llm_latency'], tokens_per_second=options['llm_tokens_per_second']
+        ))
+        overrides = {
+            'LINEBOT_WEBHOOK_MODE': 'sync',
+            'LINEBOT_LLM_BACKEND': 'fake',
+            'LINEBOT_DEBOUNCE_SECONDS': 0,
+        }
+        if not options['rate_limit']:
+            overrides['LINEBOT_OPENAI_RPM'] = 0
+
+        run_id = uuid.uuid4().hex[:8]
+        user_ids = [f"{USER_PREFIX}{run_id}{i:05d}" for i in range(options['users'])]
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.queries = []
+        self.errors = 0
+
+        self.stdout.write(
+            f"壓測開始：{options['users']} 位使用者 × {options['messages']} 則訊息，並行數 {options['concurrency']}"
+        )
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        tracemalloc.start()
+
+        with ExitStack() as stack:
+            stack.enter_context(override_settings(**overrides))
+            # LINE API 全部改成不送出
+            stack.enter_context(mock.patch.object(line_client.line_bot_api, 'reply_message'))
+            stack.enter_context(mock.patch.object(line_client.line_bot_api, 'push_message'))
+            stack.enter_context(mock.patch.object(
+                line_client.session, 'post', return_value=mock.Mock(status_code=200, text='')
+            ))
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+                list(pool.map(lambda user_id: self.run_user(user_id, options['messages']), user_ids))
+            elapsed = time.perf_counter() - started
+
+        _, traced_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        self.report(elapsed, traced_peak, rss_before, rss_after)
+
+        if not options['keep']:
+            self.cleanup(user_ids)
+
+    def run_user(self, user_id, count):
+        factory = RequestFactory()
+        try:
+            # 同一使用者的訊息依序送出，和 LINE 的行為相同
+            for index in range(count):
+                body = webhook_body(user_id, f"壓測訊息 {index + 1}")
+                request = factory.post(
+                    '/callback', data=body, content_type='application/json', HTTP_X_LINE_SIGNATURE=sign(body)
+                )
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    try:
+                        response = callback(request)
+                        failed = response.status_code != 200
+                    except Exception as e:
+                        self.stderr.write(f"[!] {user_id} 處理失敗：{str(e)}")
+                        failed = True
+                    latency = time.perf_counter() - started
+
+                with self.lock:
+                    self.latencies.append(latency)
+                    self.queries.append(len(queries))
+                    self.errors += failed
+        finally:
+            connections.close_all()
+
+    def report(self, elapsed, traced_peak, rss_before, rss_after):
+        latencies = sorted(self.latencies)
+        total = len(latencies)
+        if not total:
+            self.stdout.write('沒有送出任何事件')
+            return
+
+        self.stdout.write(f"事件數：{total}（失敗 {self.errors}），總時間 {elapsed:.2f} 秒")
+        self.stdout.write(f"吞吐量：{total / elapsed:.1f} 事件/秒")
+        self.stdout.write(
+            '延遲（毫秒）：p50 {:.1f} / p95 {:.1f} / p99 {:.1f} / max {:.1f}'.format(
+                *(percentile(latencies, pct) * 1000 for pct in (50, 95, 99)), latencies[-1] * 1000
+            )
+        )
+        self.stdout.write(
+            f"每個事件的 DB 查詢數：平均 {statistics.mean(self.queries):.1f} / 最多 {max(self.queries)}"
+        )
+        # ru_maxrss 在 Linux 的單位是 KB
+        self.stdout.write(
+            f"記憶體：Python 配置峰值 {traced_peak / 1024 / 1024:.1f} MB，"
+            f"行程 RSS 峰值 {rss_after / 1024:.1f} MB（壓測前 {rss_before / 1024:.1f} MB）"
+        )
+
+    def cleanup(self, user_ids):
+        Message.objects.filter(user_id__in=user_ids).delete()
+        SessionSummary.objects.filter(user_id__in=user_ids).delete()
+        DeferredMessage.objects.filter(user_id__in=user_ids).delete()
+        LineUser.objects.filter(user_id__in=user_ids).delete()
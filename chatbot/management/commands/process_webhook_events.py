@@ -0,0 +1,132 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from chatbot.models import WebhookEvent
+from chatbot.webhook_queue import process_event, retry_at
+
+REQUEUE_INTERVAL = 60  # 每隔幾秒檢查一次逾時的處理中事件
+
+
+class Command(BaseCommand):
+    help = '背景處理佇列中的 LINE webhook 事件（同一使用者的事件依序處理，可同時執行多個）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=settings.LINEBOT_QUEUE_CONCURRENCY,
+                            help='同時處理的使用者數量')
+        parser.add_argument('--batch-size', type=int, default=100, help='每次從佇列取出的事件數量')
+        parser.add_argument('--poll-interval', type=float, default=0.5, help='佇列為空時的等待秒數')
+        parser.add_argument('--max-attempts', type=int, default=settings.LINEBOT_QUEUE_MAX_ATTEMPTS,
+                            help='事件最多重試次數')
+        parser.add_argument('--once', action='store_true', help='處理完目前佇列後就結束')
+
+    def handle(self, *args, **options):
+        self.max_attempts = options['max_attempts']
+        self.in_flight = set()
+        self.lock = threading.Lock()
+
+        concurrency = options['concurrency']
+        self.stdout.write(f"開始處理 webhook 佇列，並行數：{concurrency}")
+
+        last_requeue = 0
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            while True:
+                if time.monotonic() - last_requeue >= REQUEUE_INTERVAL:
+                    self.requeue_stale()
+                    last_requeue = time.monotonic()
+
+                dispatched = self.dispatch_batch(pool, options['batch_size'])
+                if not dispatched:
+                    if options['once'] and not self.in_flight:
+                        break
+                    time.sleep(options['poll_interval'])
+
+    def requeue_stale(self):
+        """中斷的 worker 留下的處理中事件（超過租約時間沒有更新）重新放回佇列；其他 worker 正在處理的不動"""
+        stale_before = timezone.now() - timedelta(seconds=settings.LINEBOT_QUEUE_LEASE_SECONDS)
+        count = (
+            WebhookEvent.objects
+            .filter(Q(claimed_at__lt=stale_before) | Q(claimed_at__isnull=True), status='processing')
+            .update(status='pending')
+        )
+        if count:
+            self.stdout.write(f"重新放回佇列的逾時事件：{count} 筆")
+
+    def claim_batch(self, batch_size):
+        """在 transaction 內鎖定並標記要處理的事件；其他 worker 已鎖定的列會被跳過，不會重複取出"""
+        with self.lock:
+            busy_users = set(self.in_flight)
+
+        # 其他 worker 正在處理、或有失敗事件還在等待重試的使用者先不取，確保同一使用者的事件依序處理
+        processing = WebhookEvent.objects.filter(status='processing', user_id=OuterRef('user_id'))
+        waiting = WebhookEvent.objects.filter(
+            status='pending', not_before__gt=timezone.now(), user_id=OuterRef('user_id')
+        )
+        with transaction.atomic():
+            events = list(
+                WebhookEvent.objects
+                .select_for_update(skip_locked=True)
+                .filter(status='pending')
+                .exclude(user_id__in=busy_users)
+                .exclude(Exists(processing))
+                .exclude(Exists(waiting))
+                .order_by('id')[:batch_size]
+            )
+            if events:
+                WebhookEvent.objects.filter(id__in=[e.id for e in events]).update(
+                    status='processing', claimed_at=timezone.now()
+                )
+        return events
+
+    def dispatch_batch(self, pool, batch_size):
+        # 依使用者分組，保留事件原始順序
+        groups = OrderedDict()
+        for event in self.claim_batch(batch_size):
+            groups.setdefault(event.user_id, []).append(event)
+
+        for user_id, events in groups.items():
+            with self.lock:
+                self.in_flight.add(user_id)
+            future = pool.submit(self.process_user_events, events)
+            future.add_done_callback(lambda f, user_id=user_id: self.release(user_id))
+
+        return len(groups)
+
+    def release(self, user_id):
+        with self.lock:
+            self.in_flight.discard(user_id)
+
+    def process_user_events(self, events):
+        close_old_connections()
+        try:
+            for index, event in enumerate(events):
+                # 更新租約，排在後面的事件不會被當成中斷而被其他 worker 取走
+                WebhookEvent.objects.filter(id__in=[e.id for e in events[index:]]).update(claimed_at=timezone.now())
+                if process_event(event):
+                    continue
+
+                # 失敗時中止這個使用者剩下的事件，等待一段時間後依序重試，確保順序不亂
+                if event.attempts >= self.max_attempts:
+                    WebhookEvent.objects.filter(id=event.id).update(status='failed')
+                else:
+                    WebhookEvent.objects.filter(id=event.id).update(
+                        status='pending', not_before=retry_at(event.attempts)
+                    )
+                remaining = [e.id for e in events[index + 1:]]
+                WebhookEvent.objects.filter(id__in=remaining).update(status='pending')
+                break
+        except Exception as error:
+            # process_event 以外的錯誤（例如資料庫斷線）：還沒處理完的事件放回佇列
+            print(f"[!] 處理 {events[0].user_id} 的佇列事件失敗：{str(error)}")
+            ids = [event.id for event in events]
+            WebhookEvent.objects.filter(id__in=ids, status='processing').update(status='pending')
+        finally:
+            close_old_connections()
@@ -0,0 +1,37 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Min
+from django.utils import timezone
+
+from chatbot.analytics import RollupInProgressError, rollup
+from chatbot.models import Message
+
+
+class Command(BaseCommand):
+    help = '把 Message 彙總成每小時、每個規則的統計（HourlyRuleStats），供後台儀表板使用；建議以 cron 定期執行'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, help='重新計算最近幾個小時（預設接續上次的進度）')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='從資料庫中最早的訊息開始重新計算（已刪除的訊息不會計入）')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['rebuild']:
+            since = Message.objects.aggregate(first=Min('timestamp'))['first']
+            if since is None:
+                self.stdout.write('沒有訊息需要統計')
+                return
+        elif options['hours']:
+            since = timezone.now() - timedelta(hours=options['hours'])
+
+        try:
+            start, written = rollup(since)
+        except RollupInProgressError:
+            self.stdout.write('另一個 rollup_analytics 正在執行，略過這次')
+            return
+        if start is None:
+            self.stdout.write('沒有訊息需要統計')
+            return
+        self.stdout.write(f"已統計 {timezone.localtime(start):%Y-%m-%d %H:00} 之後的訊息，寫入 {written} 筆每小時統計")
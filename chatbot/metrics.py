@@ -0,0 +1,175 @@
+# chatbot/metrics.py
+# 計數器、計時與直方圖（count / observe / span）先累積在各 process 的記憶體，不查詢資料庫，
+# 由背景執行緒每 LINEBOT_METRICS_FLUSH_INTERVAL 秒把整份累計值寫入共用快取（每個 worker 一筆），
+# /metrics 讀取所有 worker 的累計值加總後輸出成 Prometheus 文字格式。
+import os
+import socket
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+
+KEY_PREFIX = 'metrics:'
+WORKERS_KEY = KEY_PREFIX + 'workers'
+WORKER_KEY_PREFIX = KEY_PREFIX + 'worker:'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+
+
+_lock = threading.Lock()
+_counters = {}  # (name, labels) -> 累計值
+_histograms = {}  # (name, labels) -> [buckets, 各 bucket 次數, 總和, 次數]
+_flusher = None
+
+
+def _labels(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def count(name, delta=1, **labels):
+    """本 process 的計數器，不會查詢資料庫"""
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + delta
+    _ensure_flusher()
+
+
+def observe(name, value, buckets=LATENCY_BUCKETS, **labels):
+    """本 process 的直方圖，不會查詢資料庫"""
+    key = (name, _labels(labels))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [buckets, [0] * len(buckets), 0.0, 0]
+        index = bisect_left(buckets, value)
+        if index < len(buckets):
+            histogram[1][index] += 1
+        histogram[2] += value
+        histogram[3] += 1
+    _ensure_flusher()
+
+
+@contextmanager
+def span(stage, **labels):
+    """記錄區塊的執行時間到 linebot_stage_seconds{stage=...}"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe('linebot_stage_seconds', time.perf_counter() - started, stage=stage, **labels)
+
+
+def _worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _snapshot():
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: [buckets, list(counts), total, n] for key, (buckets, counts, total, n) in _histograms.items()}
+    return {'counters': counters, 'histograms': histograms}
+
+
+def flush():
+    """把本 process 的累計值寫入共用快取"""
+    shared_cache = caches['shared']
+    worker_id = _worker_id()
+    timeout = settings.LINEBOT_METRICS_WORKER_TTL
+    shared_cache.set(WORKER_KEY_PREFIX + worker_id, _snapshot(), timeout=timeout)
+
+    workers = shared_cache.get(WORKERS_KEY) or []
+    if worker_id not in workers:
+        # 同時登記時可能蓋掉別的 worker，對方下次寫入時會再登記
+        shared_cache.set(WORKERS_KEY, workers + [worker_id], timeout=None)
+
+
+def _ensure_flusher():
+    global _flusher
+    if _flusher is not None and _flusher[0] == os.getpid():
+        return
+
+    with _lock:
+        if _flusher is not None and _flusher[0] == os.getpid():
+            return
+
+        def run():
+            while True:
+                time.sleep(settings.LINEBOT_METRICS_FLUSH_INTERVAL)
+                try:
+                    flush()
+                except Exception as e:
+                    print(f"[!] 寫入 metrics 失敗：{str(e)}")
+                finally:
+                    connections.close_all()  # 背景執行緒自己開的 DB 連線要自己關
+
+        # fork 出來的 worker 要各自啟動
+        _flusher = (os.getpid(), threading.Thread(target=run, daemon=True))
+        _flusher[1].start()
+
+
+def collect():
+    """加總所有 worker 的累計值，回傳 (counters, histograms)"""
+    shared_cache = caches['shared']
+    workers = shared_cache.get(WORKERS_KEY) or []
+    snapshots = shared_cache.get_many([WORKER_KEY_PREFIX + worker_id for worker_id in workers])
+
+    alive = [worker_id for worker_id in workers if WORKER_KEY_PREFIX + worker_id in snapshots]
+    if len(alive) != len(workers):
+        # 已經停止的 worker 過期後從清單移除
+        shared_cache.set(WORKERS_KEY, alive, timeout=None)
+
+    counters = {}
+    histograms = {}
+    for snapshot in snapshots.values():
+        for key, value in snapshot['counters'].items():
+            counters[key] = counters.get(key, 0) + value
+        for key, (buckets, counts, total, n) in snapshot['histograms'].items():
+            merged = histograms.get(key)
+            if merged is None or merged[0] != buckets:
+                histograms[key] = [buckets, list(counts), total, n]
+                continue
+            merged[1] = [a + b for a, b in zip(merged[1], counts)]
+            merged[2] += total
+            merged[3] += n
+    return counters, histograms
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = [(key, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for key, value in pairs]
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+def render():
+    """輸出 Prometheus 文字格式"""
+    flush()
+    counters, histograms = collect()
+    lines = []
+
+    typed = set()
+    for (name, labels), value in sorted(counters.items()):
+        if name not in typed:
+            lines.append(f"# TYPE {name} counter")
+            typed.add(name)
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    for (name, labels), (buckets, counts, total, n) in sorted(histograms.items()):
+        if name not in typed:
+            lines.append(f"# TYPE {name} histogram")
+            typed.add(name)
+        cumulative = 0
+        for bound, bucket_count in zip(buckets, counts):
+            cumulative += bucket_count
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', str(bound))])} {cumulative}")
+        lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {n}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+        lines.append(f"{name}_count{_format_labels(labels)} {n}")
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.1 on 2026-10-17 15:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0007_lineuser'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_type', models.CharField(max_length=50)),
+                ('user_id', models.CharField(blank=True, db_index=True, max_length=64)),
+                ('payload', models.JSONField(help_text='LINE webhook 原始事件內容')),
+                ('status', models.CharField(choices=[('pending', '待處理'), ('processing', '處理中'), ('done', '完成'), ('failed', '失敗')], default='pending', max_length=20)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('claimed_at', models.DateTimeField(blank=True, help_text='worker 取出或最後一次確認仍在處理的時間', null=True)),
+                ('not_before', models.DateTimeField(blank=True, help_text='處理失敗後，這個時間之前不重試', null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'id'], name='webhookevent_status_id_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProcessedEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.CharField(max_length=64, unique=True)),
+                ('claim_token', models.CharField(help_text='寫入這筆紀錄的請求，用來判斷是不是自己取得的', max_length=32)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+    ]
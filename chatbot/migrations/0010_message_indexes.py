@@ -0,0 +1,25 @@
+# Generated by Django 5.2.1 on 2026-10-17 15:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0009_create_shared_cache_table'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['user_id', 'timestamp'], name='message_user_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['user_id', 'session_id', 'timestamp'], name='message_user_session_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['session_id', 'timestamp'], name='message_session_ts_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.1 on 2026-10-17 15:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_conversation_state(apps, schema_editor):
+    # 以每位使用者最新的一則訊息初始化對話狀態，讓進行中的對話不會中斷
+    Message = apps.get_model('chatbot', 'Message')
+    LineUser = apps.get_model('chatbot', 'LineUser')
+
+    user_ids = Message.objects.values_list('user_id', flat=True).distinct()
+    for user_id in user_ids.iterator():
+        latest_msg = Message.objects.filter(user_id=user_id).order_by('-timestamp').first()
+        message_count = Message.objects.filter(user_id=user_id, session_id=latest_msg.session_id).count()
+        LineUser.objects.update_or_create(
+            user_id=user_id[:64],
+            defaults={
+                'session_id': latest_msg.session_id,
+                'system_prompt_rule_id': latest_msg.system_prompt_rule_id,
+                'message_count': message_count,
+            },
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0010_message_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lineuser',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0, help_text='目前 session 的訊息數'),
+        ),
+        migrations.AddField(
+            model_name='lineuser',
+            name='session_id',
+            field=models.UUIDField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='lineuser',
+            name='system_prompt_rule',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='chatbot.systempromptrule'),
+        ),
+        migrations.RunPython(backfill_conversation_state, migrations.RunPython.noop),
+    ]
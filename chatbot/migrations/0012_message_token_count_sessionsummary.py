@@ -0,0 +1,30 @@
+# Generated by Django 5.2.1 on 2026-10-17 15:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0011_lineuser_conversation_state'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SessionSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_id', models.UUIDField(unique=True)),
+                ('user_id', models.CharField(max_length=255)),
+                ('summary', models.TextField(blank=True)),
+                ('covered_until_id', models.BigIntegerField(default=0, help_text='已摘要到的最後一則 Message id')),
+                ('token_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='token_count',
+            field=models.PositiveIntegerField(default=0, help_text='寫入時估算的 token 數'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-17 15:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0012_message_token_count_sessionsummary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='systempromptrule',
+            name='cache_responses',
+            field=models.BooleanField(default=False, help_text='相同的 prompt 與對話紀錄直接使用快取的回覆，不再呼叫 OpenAI', verbose_name='快取回覆'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.1 on 2026-10-17 15:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0014_message_usage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeferredMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.CharField(db_index=True, max_length=64)),
+                ('content', models.TextField()),
+                ('reply_token', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RateLimitBucket',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('tokens', models.FloatField()),
+                ('updated_at', models.FloatField(help_text='最後更新時間（epoch 秒）')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='lineuser',
+            name='llm_busy_until',
+            field=models.DateTimeField(blank=True, help_text='LLM 回合鎖的到期時間', null=True),
+        ),
+        migrations.AddField(
+            model_name='lineuser',
+            name='llm_deferred',
+            field=models.BooleanField(default=False, help_text='回合進行中有新訊息暫存'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-17 15:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0015_deferredmessage_ratelimitbucket'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='systempromptrule',
+            name='llm_backend',
+            field=models.CharField(blank=True, choices=[('openai', 'OpenAI'), ('compatible', 'OpenAI 相容 API'), ('fake', '模擬（壓測用）')], help_text='留空則使用設定的預設後端', max_length=20, verbose_name='LLM 後端'),
+        ),
+        migrations.AddField(
+            model_name='systempromptrule',
+            name='llm_model',
+            field=models.CharField(blank=True, help_text='留空則使用設定的預設模型', max_length=100, verbose_name='模型'),
+        ),
+    ]
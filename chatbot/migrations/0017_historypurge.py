@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-17 15:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0016_systempromptrule_llm_backend'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HistoryPurge',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.CharField(db_index=True, max_length=64)),
+                ('up_to_id', models.BigIntegerField(help_text='重設時該使用者最後一則 Message id')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
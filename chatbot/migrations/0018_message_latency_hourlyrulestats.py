@@ -0,0 +1,53 @@
+# Generated by Django 5.2.1 on 2026-10-17 15:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0017_historypurge'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HourlyRuleStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField(verbose_name='時段')),
+                ('user_messages', models.PositiveIntegerField(default=0, verbose_name='使用者訊息數')),
+                ('assistant_messages', models.PositiveIntegerField(default=0, verbose_name='回覆數')),
+                ('users', models.PositiveIntegerField(default=0, verbose_name='使用者數')),
+                ('prompt_tokens', models.PositiveBigIntegerField(default=0)),
+                ('cached_tokens', models.PositiveBigIntegerField(default=0)),
+                ('completion_tokens', models.PositiveBigIntegerField(default=0)),
+                ('latency_ms_total', models.PositiveBigIntegerField(default=0, help_text='有記錄延遲的回覆的延遲總和')),
+                ('latency_count', models.PositiveIntegerField(default=0, help_text='有記錄延遲的回覆數')),
+                ('latency_ms_max', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': '每小時統計',
+                'verbose_name_plural': '每小時統計',
+            },
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='latency_ms',
+            field=models.PositiveIntegerField(blank=True, help_text='產生這則回覆花費的毫秒數', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['timestamp'], name='message_ts_idx'),
+        ),
+        migrations.AddField(
+            model_name='hourlyrulestats',
+            name='system_prompt_rule',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='hourly_stats', to='chatbot.systempromptrule', verbose_name='規則'),
+        ),
+        migrations.AddConstraint(
+            model_name='hourlyrulestats',
+            constraint=models.UniqueConstraint(fields=('hour', 'system_prompt_rule'), name='hourlystats_hour_rule_uniq'),
+        ),
+    ]
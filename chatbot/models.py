@@ -4,8 +4,23 @@ from django.contrib.auth.models import User
 import uuid
 
 class SystemPromptRule(models.Model):
+    LLM_BACKEND_CHOICES = [
+        ('openai', 'OpenAI'),
+        ('compatible', 'OpenAI 相容 API'),
+        ('fake', '模擬（壓測用）'),
+    ]
+
     trigger_text = models.CharField(max_length=255, unique=True, help_text='觸發詞，例如：我想學英文')
     system_prompt = models.TextField(help_text='對應的 system prompt 內容')
+    cache_responses = models.BooleanField(
+        default=False, verbose_name='快取回覆',
+        help_text='相同的 prompt 與對話紀錄直接使用快取的回覆，不再呼叫 OpenAI'
+    )
+    llm_backend = models.CharField(
+        max_length=20, blank=True, choices=LLM_BACKEND_CHOICES, verbose_name='LLM 後端',
+        help_text='留空則使用設定的預設後端'
+    )
+    llm_model = models.CharField(max_length=100, blank=True, verbose_name='模型', help_text='留空則使用設定的預設模型')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='建立時間')
     created_by = models.ForeignKey(
         User, null=True, blank=True, on_delete=models.SET_NULL,
@@ -22,10 +37,37 @@ class Message(models.Model):
     system_prompt_rule = models.ForeignKey(SystemPromptRule, null=True, blank=True, on_delete=models.SET_NULL)
     session_id = models.UUIDField(default=uuid.uuid4, editable=False)
     timestamp = models.DateTimeField(auto_now_add=True)
+    token_count = models.PositiveIntegerField(default=0, help_text='寫入時估算的 token 數')
+    # 助理訊息記錄 OpenAI 回傳的 usage
+    prompt_tokens = models.PositiveIntegerField(null=True, blank=True)
+    cached_tokens = models.PositiveIntegerField(null=True, blank=True)
+    completion_tokens = models.PositiveIntegerField(null=True, blank=True)
+    latency_ms = models.PositiveIntegerField(null=True, blank=True, help_text='產生這則回覆花費的毫秒數')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user_id', 'timestamp'], name='message_user_ts_idx'),
+            models.Index(fields=['user_id', 'session_id', 'timestamp'], name='message_user_session_ts_idx'),
+            # 後台的日期階層與每小時統計都以時間範圍查詢
+            models.Index(fields=['timestamp'], name='message_ts_idx'),
+            # archive_messages 依 session 分組找出最後一則訊息的時間、依 session 順序分頁匯出
+            models.Index(fields=['session_id', 'timestamp'], name='message_session_ts_idx'),
+        ]
 
     def __str__(self):
         return f"{self.timestamp} - {self.user_id} ({self.role})"
 
+class SessionSummary(models.Model):
+    session_id = models.UUIDField(unique=True)
+    user_id = models.CharField(max_length=255)
+    summary = models.TextField(blank=True)
+    covered_until_id = models.BigIntegerField(default=0, help_text='已摘要到的最後一則 Message id')
+    token_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user_id} - {self.session_id}"
+
 class SkipKeyword(models.Model):
     text = models.CharField(max_length=100, unique=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -49,5 +91,114 @@ class LineUser(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # 目前的對話狀態，每則訊息只需讀取這一列就能決定 session 與 system prompt
+    session_id = models.UUIDField(null=True, blank=True)
+    system_prompt_rule = models.ForeignKey(SystemPromptRule, null=True, blank=True, on_delete=models.SET_NULL)
+    message_count = models.PositiveIntegerField(default=0, help_text='目前 session 的訊息數')
+    # 同一使用者同時只跑一個 LLM 回合（見 limiter）
+    llm_busy_until = models.DateTimeField(null=True, blank=True, help_text='LLM 回合鎖的到期時間')
+    llm_deferred = models.BooleanField(default=False, help_text='回合進行中有新訊息暫存')
+
+    def __str__(self):
+        return f"{self.user_id} ({self.language})"
+
+class WebhookEvent(models.Model):
+    STATUS_CHOICES = [
+        ('pending', '待處理'),
+        ('processing', '處理中'),
+        ('done', '完成'),
+        ('failed', '失敗'),
+    ]
+
+    event_type = models.CharField(max_length=50)
+    user_id = models.CharField(max_length=64, blank=True, db_index=True)
+    payload = models.JSONField(help_text='LINE webhook 原始事件內容')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    claimed_at = models.DateTimeField(null=True, blank=True, help_text='worker 取出或最後一次確認仍在處理的時間')
+    not_before = models.DateTimeField(null=True, blank=True, help_text='處理失敗後，這個時間之前不重試')
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'id'], name='webhookevent_status_id_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.event_type} - {self.user_id} ({self.status})"
+
+
+class ProcessedEvent(models.Model):
+    """已處理的 webhookEventId，LINE 重送時略過；超過 LINEBOT_DEDUP_TTL 的紀錄由 dedup 定期刪除"""
+    event_id = models.CharField(max_length=64, unique=True)
+    claim_token = models.CharField(max_length=32, help_text='寫入這筆紀錄的請求，用來判斷是不是自己取得的')
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return self.event_id
+
+
+class DeferredMessage(models.Model):
+    """使用者的回覆還在產生時新進的訊息，等目前這輪結束後合併成一輪回答"""
+    user_id = models.CharField(max_length=64, db_index=True)
+    content = models.TextField()
+    reply_token = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.user_id} - {self.content[:20]}"
+
+
+class RateLimitBucket(models.Model):
+    """跨 worker 共用的 token bucket 狀態"""
+    name = models.CharField(max_length=50, primary_key=True)
+    tokens = models.FloatField()
+    updated_at = models.FloatField(help_text='最後更新時間（epoch 秒）')
+
+    def __str__(self):
+        return f"{self.name} ({self.tokens:.1f})"
+
+
+class HistoryPurge(models.Model):
+    """/reset 後待刪除的對話紀錄：刪除 id 不超過 up_to_id 的訊息，由背景分批執行"""
+    user_id = models.CharField(max_length=64, db_index=True)
+    up_to_id = models.BigIntegerField(help_text='重設時該使用者最後一則 Message id')
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.user_id} (<= {self.up_to_id})"
+
+
+class HourlyRuleStats(models.Model):
+    """每小時、每個 SystemPromptRule 的訊息統計，由 rollup_analytics 從 Message 彙總，後台儀表板只讀這張表"""
+    hour = models.DateTimeField(verbose_name='時段')
+    # 未套用規則的訊息為 NULL；規則刪除時統計保留並改為 NULL，與 Message 重新彙總的結果一致
+    system_prompt_rule = models.ForeignKey(
+        SystemPromptRule, null=True, blank=True, on_delete=models.SET_NULL,
+        verbose_name='規則', related_name='hourly_stats'
+    )
+    user_messages = models.PositiveIntegerField(default=0, verbose_name='使用者訊息數')
+    assistant_messages = models.PositiveIntegerField(default=0, verbose_name='回覆數')
+    users = models.PositiveIntegerField(default=0, verbose_name='使用者數')
+    prompt_tokens = models.PositiveBigIntegerField(default=0)
+    cached_tokens = models.PositiveBigIntegerField(default=0)
+    completion_tokens = models.PositiveBigIntegerField(default=0)
+    latency_ms_total = models.PositiveBigIntegerField(default=0, help_text='有記錄延遲的回覆的延遲總和')
+    latency_count = models.PositiveIntegerField(default=0, help_text='有記錄延遲的回覆數')
+    latency_ms_max = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = '每小時統計'
+        verbose_name_plural = '每小時統計'
+        constraints = [
+            # 有套用規則的統計每小時只有一筆，重複寫入時失敗；唯一索引不比較 NULL，
+            # 未套用規則（預設）的統計不受這個限制，由 analytics.rollup 的鎖避免重疊執行時重複寫入
+            models.UniqueConstraint(fields=['hour', 'system_prompt_rule'], name='hourlystats_hour_rule_uniq'),
+        ]
+
     def __str__(self):
-        return f"{self.user_id} ({self.language})"
\ No newline at end of file
+        return f"{self.hour:%Y-%m-%d %H:00} - {self.system_prompt_rule or '預設'}"
@@ -0,0 +1,94 @@
+# chatbot/response_cache.py
+# LLM 回覆快取：以 (model, system prompt, 正規化後的對話紀錄) 的雜湊為 key。
+# 各 worker 有一層記憶體 LRU，後面是跨 worker 共用的資料庫快取，兩層都有 TTL。
+# 只有在後台勾選「快取回覆」的 SystemPromptRule 才會使用。
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import metrics
+
+KEY_PREFIX = 'llm_reply:'
+LOOKUP_METRIC = 'linebot_response_cache_lookups_total'
+
+_lock = threading.Lock()
+_local = OrderedDict()
+
+
+def _normalize(content):
+    return ' '.join(content.split()).casefold()
+
+
+def cache_key(model, messages):
+    normalized = [[m['role'], _normalize(m['content'])] for m in messages]
+    payload = json.dumps([model, normalized], ensure_ascii=False)
+    return KEY_PREFIX + hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _enabled(system_prompt_rule):
+    return system_prompt_rule is not None and system_prompt_rule.cache_responses
+
+
+def _get_local(key):
+    with _lock:
+        item = _local.get(key)
+        if item is None:
+            return None
+        reply, expires_at = item
+        if expires_at < time.monotonic():
+            del _local[key]
+            return None
+        _local.move_to_end(key)
+        return reply
+
+
+def _set_local(key, reply):
+    with _lock:
+        _local[key] = (reply, time.monotonic() + settings.LINEBOT_RESPONSE_CACHE_TTL)
+        _local.move_to_end(key)
+        while len(_local) > settings.LINEBOT_RESPONSE_CACHE_SIZE:
+            _local.popitem(last=False)
+
+
+def get_cached_reply(model, messages, system_prompt_rule):
+    """有快取時回傳回覆文字，否則回傳 None"""
+    if not _enabled(system_prompt_rule):
+        return None
+
+    key = cache_key(model, messages)
+    reply = _get_local(key)
+    if reply is None:
+        reply = caches['shared'].get(key)
+        if reply is not None:
+            _set_local(key, reply)
+
+    # 記在本 process 的計數器，不查詢資料庫
+    metrics.count(LOOKUP_METRIC, rule=system_prompt_rule.id, result='hit' if reply is not None else 'miss')
+    return reply
+
+
+def cache_reply(model, messages, system_prompt_rule, reply):
+    if not _enabled(system_prompt_rule):
+        return
+
+    key = cache_key(model, messages)
+    _set_local(key, reply)
+    caches['shared'].set(key, reply, timeout=settings.LINEBOT_RESPONSE_CACHE_TTL)
+
+
+def stats():
+    """各規則的命中與未命中次數 {規則 id: {'hits', 'misses'}}，為所有 worker 最近一次寫入的累計值加總"""
+    counters, _ = metrics.collect()
+    result = {}
+    for (name, labels), value in counters.items():
+        if name != LOOKUP_METRIC:
+            continue
+        labels = dict(labels)
+        rule_stats = result.setdefault(int(labels['rule']), {'hits': 0, 'misses': 0})
+        rule_stats['hits' if labels['result'] == 'hit' else 'misses'] += value
+    return result
@@ -0,0 +1,93 @@
+# chatbot/retention.py
+# 對話紀錄的刪除：
+# - /reset 只重設 LineUser 的 session（邏輯重設），實際刪除記錄成 HistoryPurge，交給背景執行緒分批刪除
+# - 程序中斷時沒刪完的 HistoryPurge 會在下一次 /reset 或 archive_messages 時繼續處理
+# Message 沒有 signal 與關聯，filter(id__in=...).delete() 不會先載入資料，直接送出一個 DELETE。
+import threading
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import HistoryPurge, LineUser, Message, SessionSummary
+
+_lock = threading.Lock()
+_state = {'running': False, 'again': False}
+
+
+def delete_in_chunks(queryset, chunk_size=None):
+    """依 id 分批刪除，避免長時間鎖住資料表；回傳刪除的筆數"""
+    chunk_size = chunk_size or settings.LINEBOT_PURGE_CHUNK_SIZE
+    model = queryset.model
+    deleted = 0
+    while True:
+        ids = list(queryset.order_by('id').values_list('id', flat=True)[:chunk_size])
+        if not ids:
+            return deleted
+        count, _ = model.objects.filter(id__in=ids).delete()
+        deleted += count
+
+
+def clear_history(user_id, line_user=None):
+    """邏輯重設：下一則訊息開始新的 session，舊訊息由背景分批刪除；
+    line_user 是呼叫端已載入的 LineUser，一併重設，同一批後面的訊息才不會延續舊的 session"""
+    with transaction.atomic():
+        LineUser.objects.filter(user_id=user_id).update(session_id=None, system_prompt_rule=None, message_count=0)
+        request_purge(user_id)
+    if line_user is not None:
+        line_user.session_id = None
+        line_user.system_prompt_rule_id = None
+        line_user.message_count = 0
+
+
+def request_purge(user_id):
+    """記錄要刪除的對話紀錄，transaction 完成後由背景執行緒刪除"""
+    up_to_id = Message.objects.filter(user_id=user_id).aggregate(last_id=Max('id'))['last_id']
+    if up_to_id is None:
+        return
+    HistoryPurge.objects.create(user_id=user_id, up_to_id=up_to_id)
+    transaction.on_commit(start_worker)
+
+
+def run_purge(purge):
+    deleted = delete_in_chunks(Message.objects.filter(user_id=purge.user_id, id__lte=purge.up_to_id))
+    delete_in_chunks(SessionSummary.objects.filter(user_id=purge.user_id, covered_until_id__lte=purge.up_to_id))
+    HistoryPurge.objects.filter(pk=purge.pk).update(completed_at=timezone.now())
+    return deleted
+
+
+def process_purges():
+    """處理所有尚未完成的刪除；重複執行也只會刪除同樣的資料"""
+    total = 0
+    for purge in HistoryPurge.objects.filter(completed_at__isnull=True).order_by('id'):
+        total += run_purge(purge)
+    return total
+
+
+def start_worker():
+    """在背景執行緒處理待刪除的紀錄，每個 process 同時只有一個"""
+    with _lock:
+        _state['again'] = True
+        if _state['running']:
+            return
+        _state['running'] = True
+
+    def run():
+        try:
+            while True:
+                with _lock:
+                    # 執行期間又有新的 /reset 時再跑一輪
+                    if not _state['again']:
+                        _state['running'] = False
+                        return
+                    _state['again'] = False
+                process_purges()
+        except Exception as e:
+            print(f"[!] 刪除對話紀錄失敗：{str(e)}")
+            with _lock:
+                _state['running'] = False
+        finally:
+            connections.close_all()  # 背景執行緒自己開的 DB 連線要自己關
+
+    threading.Thread(target=run, daemon=True).start()
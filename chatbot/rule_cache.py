@@ -0,0 +1,86 @@
+# chatbot/rule_cache.py
+# SkipKeyword / SystemPromptRule 的記憶體快取。
+# 兩張表都很小且只會從後台修改，所以整張表載入成 casefold 後的 dict，
+# 比對時不需要查詢資料庫。後台儲存時更新共用快取中的版本號，
+# 各 worker 最多每 LINEBOT_RULE_CACHE_CHECK_INTERVAL 秒確認一次版本並重新載入。
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .models import SkipKeyword, SystemPromptRule
+
+VERSION_KEY = 'rule_cache_version'
+
+_lock = threading.Lock()
+_state = {
+    'version': None,
+    'checked_at': 0.0,
+    'skip_keywords': frozenset(),
+    'rules': {},
+    'rules_by_id': {},
+}
+
+
+def _shared_version():
+    shared_cache = caches['shared']
+    version = shared_cache.get(VERSION_KEY)
+    if version is None:
+        shared_cache.add(VERSION_KEY, uuid.uuid4().hex, timeout=None)
+        version = shared_cache.get(VERSION_KEY)
+    return version
+
+
+def _reload(version):
+    skip_keywords = frozenset(
+        text.casefold() for text in SkipKeyword.objects.values_list('text', flat=True)
+    )
+    rules = list(SystemPromptRule.objects.all())
+    _state.update(
+        version=version,
+        skip_keywords=skip_keywords,
+        rules={rule.trigger_text.casefold(): rule for rule in rules},
+        rules_by_id={rule.id: rule for rule in rules},
+    )
+
+
+def _ensure_fresh():
+    now = time.monotonic()
+    if _state['version'] is not None and now - _state['checked_at'] < settings.LINEBOT_RULE_CACHE_CHECK_INTERVAL:
+        return
+
+    with _lock:
+        if _state['version'] is not None and now - _state['checked_at'] < settings.LINEBOT_RULE_CACHE_CHECK_INTERVAL:
+            return
+        version = _shared_version()
+        if version != _state['version']:
+            _reload(version)
+        _state['checked_at'] = now
+
+
+def is_skip_keyword(text):
+    _ensure_fresh()
+    return text.casefold() in _state['skip_keywords']
+
+
+def match_rule(text):
+    """回傳觸發詞（不分大小寫）完全相符的 SystemPromptRule，沒有則回傳 None"""
+    _ensure_fresh()
+    return _state['rules'].get(text.casefold())
+
+
+def get_rule(rule_id):
+    _ensure_fresh()
+    return _state['rules_by_id'].get(rule_id)
+
+
+def invalidate():
+    """規則有變動時呼叫：更新共用版本號，並讓本 worker 下次使用時立即重新載入"""
+    caches['shared'].set(VERSION_KEY, uuid.uuid4().hex, timeout=None)
+    _state['version'] = None
+
+
+def warmup():
+    _ensure_fresh()
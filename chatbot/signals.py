@@ -0,0 +1,12 @@
+# chatbot/signals.py
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import SkipKeyword, SystemPromptRule
+from .rule_cache import invalidate
+
+
+@receiver([post_save, post_delete], sender=SkipKeyword)
+@receiver([post_save, post_delete], sender=SystemPromptRule)
+def invalidate_rule_cache(sender, **kwargs):
+    invalidate()
@@ -0,0 +1,120 @@
+# chatbot/streaming.py
+# 串流模式：一邊接收 OpenAI 的串流，一邊把已完成的句子送給使用者。
+# 第一段用 reply token 回覆，之後的內容以 push message 送出，整則回覆最多 5 個對話框。
+import re
+
+from django.conf import settings
+from linebot.models import TextSendMessage
+
+from .line_client import (
+    MAX_MESSAGES_PER_REQUEST, TEXT_MESSAGE_LIMIT, apush, get_async_line_bot_api, line_bot_api, push, split_text,
+)
+
+SENTENCE_END = re.compile(r'[。！？!?\n]|\.(?=\s)')
+
+
+class StreamSegmenter:
+    """把串流的文字片段切成要送出的段落"""
+
+    def __init__(self, max_messages=MAX_MESSAGES_PER_REQUEST):
+        self.max_messages = max_messages
+        self.buffer = ''
+        self.text = ''
+        self.sent = 0
+
+    def _cut(self, last=False):
+        # 只在一個對話框的長度內找句尾，切出的段落不會超過 LINE 的字數上限
+        matches = list(SENTENCE_END.finditer(self.buffer[:TEXT_MESSAGE_LIMIT]))
+        if matches:
+            end = (matches[-1] if last else matches[0]).end()
+        elif len(self.buffer) >= TEXT_MESSAGE_LIMIT:
+            # 超過上限還沒有句尾，直接在上限切開
+            end = TEXT_MESSAGE_LIMIT
+        else:
+            return None
+        segment, self.buffer = self.buffer[:end].strip(), self.buffer[end:]
+        return segment or None
+
+    def feed(self, delta):
+        """加入新的片段，回傳可以先送出的段落（可能為空）"""
+        self.buffer += delta
+        self.text += delta
+
+        if self.sent == 0:
+            # 第一句完成就先回覆，縮短使用者等待的時間
+            segment = self._cut()
+        elif self.sent < self.max_messages - 1 and len(self.buffer) >= settings.LINEBOT_STREAM_PUSH_CHARS:
+            segment = self._cut(last=True)
+        else:
+            segment = None
+
+        if segment:
+            self.sent += 1
+            return [segment]
+        return []
+
+    def flush(self):
+        """串流結束，回傳剩下的段落（不超過剩餘的對話框數）"""
+        rest, self.buffer = self.buffer.strip(), ''
+        segments = split_text(rest, max_parts=self.max_messages - self.sent) if rest else []
+        self.sent += len(segments)
+        return segments
+
+
+class StreamReplySender:
+    """第一次送出使用 reply token，之後改用 push message"""
+
+    def __init__(self, reply_token, user_id, indicator=None):
+        self.reply_token = reply_token
+        self.user_id = user_id
+        self.indicator = indicator  # 思考動畫，送出第一段前停止
+        self.replied = not reply_token  # 沒有 reply token 時一開始就用 push
+        self.usage = None  # 串流最後一個 chunk 帶回的 token 用量
+
+    def send(self, texts):
+        if not texts:
+            return
+        if self.indicator:
+            self.indicator.stop()
+        messages = [TextSendMessage(text=text) for text in texts]
+        if self.replied:
+            push(self.user_id, messages)
+        else:
+            line_bot_api.reply_message(self.reply_token, messages)
+            self.replied = True
+
+    def send_stream(self, stream):
+        """送出串流內容，回傳完整的回覆文字"""
+        segmenter = StreamSegmenter()
+        for chunk in stream:
+            if chunk.usage:
+                self.usage = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                self.send(segmenter.feed(chunk.choices[0].delta.content))
+        self.send(segmenter.flush())
+        return segmenter.text.strip()
+
+
+class AsyncStreamReplySender(StreamReplySender):
+
+    async def send(self, texts):
+        if not texts:
+            return
+        if self.indicator:
+            await self.indicator.stop()
+        messages = [TextSendMessage(text=text) for text in texts]
+        if self.replied:
+            await apush(self.user_id, messages)
+        else:
+            await get_async_line_bot_api().reply_message(self.reply_token, messages)
+            self.replied = True
+
+    async def send_stream(self, stream):
+        segmenter = StreamSegmenter()
+        async for chunk in stream:
+            if chunk.usage:
+                self.usage = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                await self.send(segmenter.feed(chunk.choices[0].delta.content))
+        await self.send(segmenter.flush())
+        return segmenter.text.strip()
@@ -0,0 +1,46 @@
+"""
+測試共用的 fixture：LLM 改為 FakeBackend（無延遲），LINE API 全部模擬，webhook 以正確的簽章送到 callback。
+"""
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+from django.test import RequestFactory, override_settings
+
+from chatbot import line_client
+from chatbot.llm_backends import FakeBackend, register_backend
+from chatbot.management.commands.bench_webhook import sign, webhook_body
+from chatbot.views import callback
+
+
+@pytest.fixture
+def fake_services():
+    """回傳 reply / push / loading 三個 mock，分別對應 LINE 的回覆、推播與載入動畫"""
+    register_backend('fake', FakeBackend(latency=0, tokens_per_second=1_000_000, reply_tokens=20))
+    with override_settings(
+        LINEBOT_WEBHOOK_MODE='sync',
+        LINEBOT_LLM_BACKEND='fake',
+        LINEBOT_DEBOUNCE_SECONDS=0,
+    ), mock.patch.object(line_client.line_bot_api, 'reply_message') as reply, \
+            mock.patch.object(line_client.line_bot_api, 'push_message') as push, \
+            mock.patch.object(line_client.session, 'post', return_value=mock.Mock(status_code=200, text='')) as loading:
+        yield SimpleNamespace(reply=reply, push=push, loading=loading)
+
+
+@pytest.fixture
+def signed_request():
+    """建立送到 /callback 的請求；signature 未指定時以 LINE_CHANNEL_SECRET 簽章"""
+    def build(body, signature=None):
+        return RequestFactory().post(
+            '/callback', data=body, content_type='application/json',
+            HTTP_X_LINE_SIGNATURE=signature or sign(body),
+        )
+    return build
+
+
+@pytest.fixture
+def post_message(fake_services, signed_request):
+    """以 user_id 傳送一則或多則（同一個 webhook）文字訊息，回傳 callback 的回應"""
+    def post(user_id, *texts):
+        return callback(signed_request(webhook_body(user_id, *texts)))
+    return post
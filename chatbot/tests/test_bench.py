@@ -0,0 +1,59 @@
+"""
+callback 的 pytest-benchmark 測試：與 bench_webhook 使用相同的簽章與 webhook 內容，
+LINE API 與 LLM 皆為模擬（conftest.fake_services），量測單一事件在 callback 內的處理時間。
+
+    pytest chatbot/tests/test_bench.py
+"""
+import uuid
+
+import pytest
+
+from chatbot.management.commands.bench_webhook import webhook_body
+from chatbot.models import Message
+from chatbot.views import callback
+
+ROUNDS = 20
+
+
+@pytest.fixture
+def new_message(signed_request):
+    def build(user_id, text):
+        # 每一輪使用新的 webhookEventId，才不會被當成重送略過
+        return (signed_request(webhook_body(user_id, text)),), {}
+    return build
+
+
+@pytest.mark.django_db
+def test_text_message(benchmark, fake_services, post_message, new_message):
+    user_id = f"Utest{uuid.uuid4().hex[:8]}"
+    post_message(user_id, '你好')  # 先建立使用者與 session
+
+    response = benchmark.pedantic(
+        callback, setup=lambda: new_message(user_id, '今天天氣如何？'), rounds=ROUNDS
+    )
+
+    assert response.status_code == 200
+    # 每一輪都存下使用者訊息與回覆
+    assert Message.objects.filter(user_id=user_id).count() == (ROUNDS + 1) * 2
+    assert fake_services.reply.call_count == ROUNDS + 1
+
+
+@pytest.mark.django_db
+def test_command(benchmark, fake_services, new_message):
+    user_id = f"Utest{uuid.uuid4().hex[:8]}"
+
+    response = benchmark.pedantic(callback, setup=lambda: new_message(user_id, '/lang en'), rounds=ROUNDS)
+
+    assert response.status_code == 200
+    assert not Message.objects.filter(user_id=user_id).exists()
+    assert fake_services.reply.call_count == ROUNDS
+
+
+@pytest.mark.django_db
+def test_invalid_signature(benchmark, fake_services, signed_request):
+    body = webhook_body('Utest', '你好')
+
+    response = benchmark(callback, signed_request(body, signature='invalid'))
+
+    assert response.status_code == 400
+    assert not fake_services.reply.called
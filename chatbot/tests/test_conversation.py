@@ -0,0 +1,58 @@
+"""
+對話狀態（LineUser 的 session、規則與訊息數）在同一個 webhook 的多則訊息與並行請求之間保持一致。
+"""
+import pytest
+
+from chatbot.models import LineUser, Message
+from chatbot.retention import clear_history
+from chatbot.views import save_turn
+
+USER_ID = 'Uconversation'
+
+pytestmark = pytest.mark.django_db
+
+
+def messages(session_id):
+    return list(Message.objects.filter(session_id=session_id).order_by('id').values_list('content', flat=True))
+
+
+def test_reset_then_message_in_same_webhook_starts_new_session(post_message):
+    post_message(USER_ID, '舊的話題')
+    old_session = LineUser.objects.get(user_id=USER_ID).session_id
+
+    post_message(USER_ID, '/reset', '新的話題')
+
+    line_user = LineUser.objects.get(user_id=USER_ID)
+    assert line_user.session_id not in (None, old_session)
+    assert line_user.message_count == 2
+    assert messages(line_user.session_id)[0] == '新的話題'
+    # 舊的 session 只有 /reset 之前的一輪（使用者訊息與回覆）
+    assert len(messages(old_session)) == 2
+
+
+def test_in_flight_turn_does_not_restore_reset_session(post_message):
+    post_message(USER_ID, '舊的話題')
+    # 另一個請求載入的 LineUser，回答期間使用者送出 /reset
+    line_user = LineUser.objects.get(user_id=USER_ID)
+    old_session = line_user.session_id
+    clear_history(USER_ID)
+
+    save_turn(line_user, old_session, None, ['還在回答的訊息'], '回覆')
+
+    stored = LineUser.objects.get(user_id=USER_ID)
+    assert (stored.session_id, stored.message_count) == (None, 0)
+    assert line_user.session_id is None
+
+
+def last_reply(fake_services):
+    reply_token, sent = fake_services.reply.call_args.args
+    return '\n'.join(message.text for message in sent)
+
+
+def test_history_in_same_webhook_includes_new_turn(fake_services, post_message):
+    post_message(USER_ID, '第一則', '/history')
+    assert '第一則' in last_reply(fake_services)
+
+    # 第 1 頁已經快取，新的一輪之後要換成新的內容
+    post_message(USER_ID, '第二則', '/history')
+    assert '第二則' in last_reply(fake_services)
@@ -0,0 +1,59 @@
+"""
+limiter：使用者回合鎖、暫存訊息的標記與全域 token bucket。
+"""
+import pytest
+from django.test import override_settings
+
+from chatbot.limiter import acquire_user, defer_message, release_user, try_take_token
+from chatbot.models import DeferredMessage, LineUser, Message
+from chatbot.views import drain_deferred
+
+USER_ID = 'Ulimiter'
+
+pytestmark = pytest.mark.django_db
+
+
+def test_user_lock_is_single_flight():
+    LineUser.objects.create(user_id=USER_ID)
+
+    assert acquire_user(USER_ID)
+    assert not acquire_user(USER_ID)
+    assert release_user(USER_ID) is False
+    assert acquire_user(USER_ID)
+
+
+def test_release_reports_messages_deferred_during_turn():
+    LineUser.objects.create(user_id=USER_ID)
+    assert acquire_user(USER_ID)
+
+    defer_message(USER_ID, '回答期間傳來的訊息', 'token')
+
+    assert release_user(USER_ID) is True
+    # 標記已清除，下一輪正常釋放
+    assert acquire_user(USER_ID)
+    assert release_user(USER_ID) is False
+
+
+def test_message_deferred_while_busy_is_answered_after_release(fake_services, post_message):
+    post_message(USER_ID, '第一則')
+    # 另一個請求正在回答
+    assert acquire_user(USER_ID)
+
+    post_message(USER_ID, '第二則')
+    assert DeferredMessage.objects.filter(user_id=USER_ID).exists()
+
+    # 持有回合鎖的請求結束時看到標記，接著回答暫存的訊息
+    assert release_user(USER_ID) is True
+    drain_deferred(LineUser.objects.get(user_id=USER_ID))
+    assert not DeferredMessage.objects.filter(user_id=USER_ID).exists()
+    assert Message.objects.filter(user_id=USER_ID, content='第二則').exists()
+
+
+@override_settings(LINEBOT_OPENAI_RPM=60, LINEBOT_OPENAI_BURST=2)
+def test_token_bucket_limits_burst():
+    assert try_take_token('test') == (True, 0)
+    assert try_take_token('test') == (True, 0)
+
+    taken, wait = try_take_token('test')
+    assert not taken
+    assert 0 < wait <= 1
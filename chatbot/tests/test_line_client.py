@@ -0,0 +1,62 @@
+"""
+非同步 LINE API 呼叫的重試：只在連線建立失敗與 429 時重試，push 重試時沿用同一個 retry key。
+"""
+import asyncio
+from unittest import mock
+
+import aiohttp
+import pytest
+from django.test import override_settings
+from linebot.models import TextSendMessage
+
+from chatbot import line_client
+
+
+def fake_response(status):
+    return mock.Mock(status=status, headers={})
+
+
+@pytest.fixture(autouse=True)
+def no_backoff():
+    with override_settings(LINEBOT_HTTP_RETRIES=2, LINEBOT_HTTP_BACKOFF=0):
+        yield
+
+
+def test_retries_connect_errors_and_429():
+    post = mock.AsyncMock(side_effect=[aiohttp.ConnectionTimeoutError(), fake_response(429), fake_response(200)])
+
+    response = asyncio.run(line_client._apost(post, 'https://api.line.me/v2/bot/message/push'))
+
+    assert response.status == 200
+    assert post.call_count == 3
+
+
+def test_does_not_retry_after_request_was_sent():
+    # 讀取逾時或 5xx 時 LINE 可能已經送出訊息
+    post = mock.AsyncMock(side_effect=aiohttp.SocketTimeoutError())
+    with pytest.raises(aiohttp.SocketTimeoutError):
+        asyncio.run(line_client._apost(post, 'https://api.line.me/v2/bot/message/reply'))
+    assert post.call_count == 1
+
+    post = mock.AsyncMock(return_value=fake_response(500))
+    assert asyncio.run(line_client._apost(post, 'https://api.line.me/v2/bot/message/reply')).status == 500
+    assert post.call_count == 1
+
+
+def test_gives_up_after_retries():
+    post = mock.AsyncMock(return_value=fake_response(429))
+
+    assert asyncio.run(line_client._apost(post, 'https://api.line.me/v2/bot/message/push')).status == 429
+    assert post.call_count == 3
+
+
+def test_push_retry_keeps_retry_key():
+    session = mock.Mock()
+    session.post = mock.AsyncMock(side_effect=[fake_response(429), fake_response(200)])
+    api = line_client.AsyncLineBotApi('token', line_client.RetryingAiohttpClient(session))
+
+    with mock.patch.object(line_client, 'get_async_line_bot_api', return_value=api):
+        asyncio.run(line_client.apush('Uretry', TextSendMessage(text='你好')))
+
+    keys = [call.kwargs['headers']['X-Line-Retry-Key'] for call in session.post.call_args_list]
+    assert len(keys) == 2 and keys[0] == keys[1]
@@ -0,0 +1,41 @@
+"""
+思考動畫：送出回覆前要等送出中的 loading 請求結束，回覆從快取取得時不送出動畫。
+"""
+import time
+from unittest import mock
+
+import pytest
+
+from chatbot import response_cache
+from chatbot.models import SystemPromptRule
+
+pytestmark = pytest.mark.django_db
+
+
+def test_loading_request_finishes_before_reply(fake_services, post_message):
+    calls = []
+
+    def slow_loading(*args, **kwargs):
+        time.sleep(0.2)
+        calls.append('loading')
+        return mock.Mock(status_code=200, text='')
+
+    fake_services.loading.side_effect = slow_loading
+    fake_services.reply.side_effect = lambda *args, **kwargs: calls.append('reply')
+
+    post_message('Uloading', '你好')
+
+    assert calls == ['loading', 'reply']
+
+
+def test_cached_reply_does_not_send_loading(fake_services, post_message):
+    SystemPromptRule.objects.create(trigger_text='翻譯模式', system_prompt='你是翻譯', cache_responses=True)
+    response_cache._local.clear()
+
+    post_message('Ucachemiss', '翻譯模式')
+    assert fake_services.loading.call_count == 1
+
+    # 另一位使用者送出相同的觸發詞，對話紀錄相同，直接使用快取的回覆
+    post_message('Ucachehit', '翻譯模式')
+    assert fake_services.loading.call_count == 1
+    assert fake_services.reply.call_count == 2
@@ -0,0 +1,58 @@
+"""
+每則訊息在 callback 內執行的 SQL 數量（查詢預算）：LINE API 與 LLM 皆為模擬，流量控制使用預設設定
+（LINEBOT_OPENAI_RPM=500，每個回合都會取 token bucket 的額度）。
+
+一般的文字訊息預算是 8 個查詢，低於改版前每則訊息約 9 次的資料庫往返；新增查詢時這裡會失敗，
+需確認是否必要，並一併調整預算與下方的明細。
+TestCase 在交易內執行，每個 transaction.atomic 會多出 SAVEPOINT 與 RELEASE SAVEPOINT 兩個敘述，
+正式環境（autocommit）不會有這兩個敘述，因此分開計算。
+"""
+import pytest
+from django.test import TestCase
+
+from chatbot.models import LineUser, Message
+
+USER_ID = 'Uquerybudget'
+
+# 一般的文字訊息：
+#   事件去重 INSERT 1、載入使用者 1、取得回合鎖 1、歷史訊息 1、token bucket 1、
+#   寫入訊息 1、更新對話狀態 1、釋放回合鎖 1
+TEXT_MESSAGE_QUERIES = 8
+TEXT_MESSAGE_ATOMIC_BLOCKS = 2  # 事件去重、寫入這一輪
+# /lang：事件去重 INSERT 1、更新語言 1；不需要載入使用者
+COMMAND_QUERIES = 2
+COMMAND_ATOMIC_BLOCKS = 1
+
+
+def with_savepoints(queries, atomic_blocks):
+    return queries + 2 * atomic_blocks
+
+
+class CallbackQueryBudgetTests(TestCase):
+    @pytest.fixture(autouse=True)
+    def services(self, fake_services, post_message):
+        self.reply = fake_services.reply
+        self.post_message = post_message
+
+    def setUp(self):
+        # 第一則訊息建立使用者、session 與 token bucket，並載入各個 process 內的快取
+        self.post('你好')
+
+    def post(self, text):
+        response = self.post_message(USER_ID, text)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_text_message(self):
+        with self.assertNumQueries(with_savepoints(TEXT_MESSAGE_QUERIES, TEXT_MESSAGE_ATOMIC_BLOCKS)):
+            self.post('今天天氣如何？')
+
+        self.assertEqual(self.reply.call_count, 2)
+        self.assertEqual(Message.objects.filter(user_id=USER_ID).count(), 4)
+        self.assertEqual(LineUser.objects.get(user_id=USER_ID).message_count, 4)
+
+    def test_command(self):
+        with self.assertNumQueries(with_savepoints(COMMAND_QUERIES, COMMAND_ATOMIC_BLOCKS)):
+            self.post('/lang en')
+
+        self.assertEqual(LineUser.objects.get(user_id=USER_ID).language, 'en')
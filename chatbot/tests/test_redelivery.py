@@ -0,0 +1,41 @@
+"""
+LINE 重送同一個 webhook 事件時：已經寫入資料庫的事件不會再處理一次，寫入前就失敗的事件會重新處理。
+"""
+from unittest import mock
+
+import pytest
+
+from chatbot import dedup
+from chatbot.management.commands.bench_webhook import webhook_body
+from chatbot.models import Message
+from chatbot.views import callback
+
+USER_ID = 'Uredelivery'
+
+pytestmark = pytest.mark.django_db
+
+
+def test_reply_failure_keeps_event_claimed(fake_services, signed_request):
+    body = webhook_body(USER_ID, '你好')
+    fake_services.reply.side_effect = RuntimeError('LINE API 沒有回應')
+    assert callback(signed_request(body)).status_code == 200
+
+    # 重送可能由其他 worker 收到，只靠資料庫的紀錄判斷
+    fake_services.reply.side_effect = None
+    dedup._recent.clear()
+    callback(signed_request(body))
+
+    assert Message.objects.filter(user_id=USER_ID).count() == 2
+    assert fake_services.reply.call_count == 1
+
+
+def test_failure_before_persistence_releases_event(fake_services, signed_request):
+    body = webhook_body(USER_ID, '你好')
+    with mock.patch('chatbot.views.save_turn', side_effect=RuntimeError('資料庫沒有回應')):
+        with pytest.raises(RuntimeError):
+            callback(signed_request(body))
+
+    callback(signed_request(body))
+
+    assert Message.objects.filter(user_id=USER_ID).count() == 2
+    assert fake_services.reply.call_count == 1
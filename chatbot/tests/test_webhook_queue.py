@@ -0,0 +1,57 @@
+"""
+webhook 佇列：沒有 userId 的事件直接略過，失敗的事件等待一段時間後才依序重試。
+"""
+import json
+import threading
+from datetime import timedelta
+from unittest import mock
+
+import pytest
+from django.utils import timezone
+
+from chatbot.management.commands.bench_webhook import webhook_body
+from chatbot.management.commands.process_webhook_events import Command
+from chatbot.models import Message, WebhookEvent
+from chatbot.webhook_queue import enqueue_webhook, process_event
+
+USER_ID = 'Uqueue'
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def worker():
+    command = Command()
+    command.max_attempts = 3
+    command.in_flight = set()
+    command.lock = threading.Lock()
+    return command
+
+
+def test_event_without_user_id_is_skipped(fake_services):
+    body = json.loads(webhook_body(USER_ID, '大家好'))
+    body['events'][0]['source'] = {'type': 'group', 'groupId': 'Cgroup'}
+    enqueue_webhook(json.dumps(body))
+    event = WebhookEvent.objects.get()
+
+    assert process_event(event)
+    assert event.status == 'done'
+    assert not Message.objects.exists()
+    assert not fake_services.reply.called
+
+
+def test_failed_event_waits_before_retry(fake_services, worker):
+    enqueue_webhook(webhook_body(USER_ID, '第一則', '第二則'))
+    events = worker.claim_batch(10)
+
+    with mock.patch('chatbot.webhook_queue.dispatch_event', side_effect=RuntimeError('LLM 沒有回應')):
+        worker.process_user_events(events)
+
+    failed = WebhookEvent.objects.get(id=events[0].id)
+    assert (failed.status, failed.attempts) == ('pending', 1)
+    assert failed.not_before > timezone.now()
+    # 同一使用者後面的事件也要等失敗的事件重試，不能先處理
+    assert worker.claim_batch(10) == []
+
+    WebhookEvent.objects.filter(id=failed.id).update(not_before=timezone.now() - timedelta(seconds=1))
+    assert [event.id for event in worker.claim_batch(10)] == [event.id for event in events]
@@ -1,7 +1,14 @@
 # chatbot/urls.py
+from django.conf import settings
 from django.urls import path
 from . import views
 
+if settings.LINEBOT_WEBHOOK_MODE == 'async':
+    from .async_views import acallback as callback_view
+else:
+    callback_view = views.callback
+
 urlpatterns = [
-    path('callback', views.callback, name='callback'),
+    path('callback', callback_view, name='callback'),
+    path('metrics', views.metrics_view, name='metrics'),
 ]
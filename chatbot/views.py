@@ -1,15 +1,35 @@
 # chatbot/views.py
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
 from django.views.decorators.csrf import csrf_exempt
-from django.http import HttpResponse, HttpResponseBadRequest
-from linebot import LineBotApi, WebhookHandler
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden
+from linebot import WebhookParser
 from linebot.exceptions import InvalidSignatureError
 from linebot.models import MessageEvent, TextMessage, TextSendMessage
-from .models import Message, SkipKeyword, SystemPromptRule, LineUser
+from . import commands, metrics
+from .models import Message, LineUser
+from .dedup import filter_new_events, release_events
+from .history import (
+    HistoryWindow, count_tokens, get_history_window, pending_summary_request, store_summary, summary_message,
+)
+from .limiter import (
+    BUSY_REPLY, acquire_user, defer_message, has_deferred, is_latest_deferred, pop_deferred, release_user,
+    take_llm_token,
+)
+from .llm_backends import resolve
+from .llm_gateway import chat, reply_deadline
+from .line_client import LoadingIndicator, reply_or_push, split_text
+from .response_cache import cache_reply, get_cached_reply
+from .rule_cache import get_rule, is_skip_keyword, match_rule
+from .streaming import StreamReplySender
+from .webhook_queue import enqueue_webhook
 import os
-import openai
+import time
 import uuid
 from dotenv import load_dotenv
-import requests
 
 load_dotenv()
 
@@ -22,138 +42,410 @@ if not LINE_CHANNEL_SECRET or not LINE_CHANNEL_ACCESS_TOKEN:
 if not OPENAI_API_KEY:
     raise Exception('OpenAI API key is not set in .env')
 
-line_bot_api = LineBotApi(LINE_CHANNEL_ACCESS_TOKEN)
-handler = WebhookHandler(LINE_CHANNEL_SECRET)
-openai.api_key = OPENAI_API_KEY
+parser = WebhookParser(LINE_CHANNEL_SECRET)
 
-MAX_HISTORY = 10
+DEFAULT_SYSTEM_PROMPT = '要簡短回答，不要超過50字，對話的語系要用zh-tw'
+# 依 /lang 設定的語言選擇預設 prompt
+DEFAULT_SYSTEM_PROMPTS = {
+    'zh': DEFAULT_SYSTEM_PROMPT,
+    'en': 'Keep answers short, under 50 words, and reply in English.',
+}
+ERROR_REPLY = '抱歉，我現在無法回覆，請稍後再試一次。'
 
-def get_user_history(user_id, session_id):
-    messages = Message.objects.filter(user_id=user_id, session_id=session_id).order_by('timestamp')
-    return [{'role': m.role, 'content': m.content} for m in messages][-MAX_HISTORY*2:]
+def advance_conversation(line_user, session_id, system_prompt_rule, count=1):
+    """原子地更新使用者目前的 session、system prompt 規則與訊息數
 
-def add_message(user_id, role, content, session_id, system_prompt_rule_id=None):
-    system_prompt_rule = None
-    if system_prompt_rule_id:
-        try:
-            system_prompt_rule = SystemPromptRule.objects.get(id=system_prompt_rule_id)
-        except SystemPromptRule.DoesNotExist:
-            pass  # 安全防呆，不讓 get 出錯導致整個掛掉
-
-    Message.objects.create(
-        user_id=user_id,
-        role=role,
-        content=content,
-        session_id=session_id,
-        system_prompt_rule=system_prompt_rule
-    )
-
-def clear_history(user_id):
-    Message.objects.filter(user_id=user_id).delete()
-
-def send_loading(chat_id, seconds):
-    url = "https://api.line.me/v2/bot/chat/loading/start"
-    headers = {
-        "Authorization": f"Bearer {LINE_CHANNEL_ACCESS_TOKEN}",
-        "Content-Type": "application/json"
-    }
-    payload = {
-        "chatId": chat_id,
-        "loadingSeconds": seconds
+    延續 session 時只在它仍是目前的 session 才更新：回答期間其他請求的 /reset 已清除 session 時，
+    不會把舊的 session 寫回去（這一輪的訊息留在舊 session，由 /reset 之後的下一則訊息開始新的 session）。
+    """
+    system_prompt_rule_id = system_prompt_rule.id if system_prompt_rule else None
+    users = LineUser.objects.filter(pk=line_user.pk)
+    if line_user.session_id == session_id:
+        updated = users.filter(session_id=session_id).update(
+            system_prompt_rule_id=system_prompt_rule_id, message_count=F('message_count') + count,
+        )
+        if not updated:
+            line_user.refresh_from_db(fields=['session_id', 'system_prompt_rule', 'message_count'])
+            return
+        line_user.message_count += count
+    else:
+        users.update(session_id=session_id, system_prompt_rule_id=system_prompt_rule_id, message_count=count)
+        line_user.message_count = count
+    # 同一批後面的 /history 以這些值判斷範圍與快取的 key
+    line_user.session_id = session_id
+    line_user.system_prompt_rule_id = system_prompt_rule_id
+
+def usage_fields(usage):
+    """把 OpenAI 的 usage 轉成 Message 的欄位"""
+    if usage is None:
+        return {}
+    details = getattr(usage, 'prompt_tokens_details', None)
+    return {
+        'prompt_tokens': usage.prompt_tokens,
+        'cached_tokens': (details.cached_tokens or 0) if details else 0,
+        'completion_tokens': usage.completion_tokens,
     }
-    try:
-        response = requests.post(url, headers=headers, json=payload)
-        if response.status_code != 200:
-            print(f"[!] send_loading 失敗：{response.status_code} - {response.text}")
-    except Exception as e:
-        print(f"[!] send_loading 發生錯誤：{str(e)}")
+
+def save_turn(line_user, session_id, system_prompt_rule, user_messages, reply=None, usage=None, latency=None):
+    """在同一個 transaction 內一次寫入這一輪的使用者與助理訊息，並更新對話狀態；latency 為產生回覆的秒數"""
+    turn = [
+        Message(
+            user_id=line_user.user_id, role='user', content=user_message,
+            session_id=session_id, system_prompt_rule=system_prompt_rule,
+            token_count=count_tokens(user_message),
+        )
+        for user_message in user_messages
+    ]
+    if reply is not None:
+        turn.append(Message(
+            user_id=line_user.user_id, role='assistant', content=reply,
+            session_id=session_id, system_prompt_rule=system_prompt_rule,
+            token_count=count_tokens(reply),
+            latency_ms=round(latency * 1000) if latency is not None else None,
+            **usage_fields(usage),
+        ))
+
+    with transaction.atomic():
+        Message.objects.bulk_create(turn)
+        advance_conversation(line_user, session_id, system_prompt_rule, count=len(turn))
+
+def report_reply_error(error):
+    """回覆送出失敗：這一輪已經寫入資料庫（或指令已經執行），只記錄錯誤，不往外丟；
+    事件維持已處理，LINE 重送時不會再呼叫一次 LLM、重複寫入訊息"""
+    print(f"[!] 送出回覆失敗：{str(error)}")
+    metrics.count('linebot_errors_total', stage='reply_send')
+
+def metrics_view(request):
+    """Prometheus 格式的 metrics（所有 worker 加總）；設定 LINEBOT_METRICS_TOKEN 時需帶 Bearer token"""
+    token = settings.LINEBOT_METRICS_TOKEN
+    if token and request.headers.get('Authorization') != f"Bearer {token}":
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 @csrf_exempt
 def callback(request):
     signature = request.headers.get('X-Line-Signature')
     body = request.body.decode('utf-8')
 
+    # 佇列模式：只驗證簽章並寫入佇列，立即回應 LINE
+    if settings.LINEBOT_WEBHOOK_MODE == 'queue':
+        with metrics.span('signature_verify'):
+            valid = parser.signature_validator.validate(body, signature or '')
+        if not valid:
+            metrics.count('linebot_invalid_signatures_total')
+            return HttpResponseBadRequest('Invalid signature')
+        enqueue_webhook(body)
+        return HttpResponse('OK')
+
     try:
-        handler.handle(body, signature)
+        with metrics.span('signature_verify'):
+            events = parser.parse(body, signature)
     except InvalidSignatureError:
+        metrics.count('linebot_invalid_signatures_total')
         return HttpResponseBadRequest('Invalid signature')
 
+    handle_events(events)
     return HttpResponse('OK')
 
-@handler.add(MessageEvent, message=TextMessage)
-def handle_message(event):
-    user_id = event.source.user_id
-    user_message = event.message.text.strip()
+def group_text_events(events):
+    """以 webhookEventId 去除同一批內的重複，並把文字訊息事件依使用者分組（保留原始順序）"""
+    seen = set()
+    groups = OrderedDict()
+    for event in events:
+        event_id = getattr(event, 'webhook_event_id', None)
+        if event_id:
+            if event_id in seen:
+                continue
+            seen.add(event_id)
+
+        if not (isinstance(event, MessageEvent) and isinstance(event.message, TextMessage)):
+            continue
+        if event.source.user_id:
+            groups.setdefault(event.source.user_id, []).append(event)
+    return groups
 
-    # 確保 LineUser 存在
+def needs_line_user(events):
+    """這些事件是否需要載入 LineUser；只有不需要使用者資料的指令時可以省下查詢"""
+    for event in events:
+        matched = commands.match(event.message.text.strip())
+        if matched is None or matched[0].needs_user:
+            return True
+    return False
+
+def handle_events(events):
+    """處理同一個 webhook 的所有事件：使用者一次載入，不同使用者並行、同一使用者依序處理"""
+    groups = group_text_events(filter_new_events(events))
+    if not groups:
+        return
+
+    with metrics.span('user_upsert'):
+        line_users = get_line_users([user_id for user_id, user_events in groups.items() if needs_line_user(user_events)])
+
+    def handle_user_events(user_id):
+        user_events = groups[user_id]
+        for index, event in enumerate(user_events):
+            try:
+                handle_message(event, line_users.get(user_id), wait=index == len(user_events) - 1)
+            except Exception:
+                metrics.count('linebot_errors_total', stage='handle_message')
+                # 寫入資料庫前就失敗的事件（送出回覆的錯誤不會丟到這裡）釋放掉，LINE 重送時才會重新處理
+                release_events(user_events[index:])
+                raise
+
+    def handle_user_events_in_thread(user_id):
+        try:
+            handle_user_events(user_id)
+        finally:
+            connections.close_all()  # 執行緒各自開的 DB 連線要自己關
+
+    if len(groups) == 1:
+        handle_user_events(next(iter(groups)))
+        return
+
+    max_workers = min(len(groups), settings.LINEBOT_BATCH_CONCURRENCY)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        list(pool.map(handle_user_events_in_thread, groups))
+
+def get_line_user(user_id):
+    """取得 LineUser（含目前的對話狀態），不存在時建立"""
     line_user, created = LineUser.objects.get_or_create(user_id=user_id)
     if created:
         print(f"新使用者：{line_user.user_id}，預設語言：{line_user.language}")
+    return line_user
+
+def get_line_users(user_ids):
+    """一次取得多位 LineUser，不存在的批次建立，回傳 {user_id: LineUser}"""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return {}
+    line_users = LineUser.objects.in_bulk(user_ids)
+    missing = [user_id for user_id in user_ids if user_id not in line_users]
+    if missing:
+        LineUser.objects.bulk_create([LineUser(user_id=user_id) for user_id in missing], ignore_conflicts=True)
+        line_users.update(LineUser.objects.in_bulk(missing))
+        for user_id in missing:
+            print(f"新使用者：{user_id}，預設語言：{line_users[user_id].language}")
+    return line_users
+
+def text_messages(reply):
+    return [TextSendMessage(text=text) for text in ([reply] if isinstance(reply, str) else reply)]
+
+def prepare_conversation(line_user, user_messages):
+    """決定 session 與 system prompt 並組出送給 LLM 的訊息，回傳 (session_id, system_prompt_rule, messages, window)
+
+    user_messages 是這一輪要回答的使用者訊息（合併回答時會有多則），觸發詞以第一則判斷。
+    這裡不寫入資料庫，這一輪的訊息在取得回覆後由 save_turn 一次寫入。
+    """
+    with metrics.span('rule_matching'):
+        system_prompt_rule = match_rule(user_messages[0])
+    if system_prompt_rule:
+        session_id = uuid.uuid4()
+        window = HistoryWindow()
+    elif line_user.session_id:
+        # 延續目前的 session；規則從快取取得，不需要查詢
+        session_id = line_user.session_id
+        system_prompt_rule = get_rule(line_user.system_prompt_rule_id) if line_user.system_prompt_rule_id else None
+        with metrics.span('history_load'):
+            window = get_history_window(line_user.user_id, session_id)
+    else:
+        session_id = uuid.uuid4()
+        window = HistoryWindow()
+
+    # 如果沒紀錄，fallback 給一個預設的 prompt
+    if system_prompt_rule:
+        system_prompt = system_prompt_rule.system_prompt
+    else:
+        system_prompt = DEFAULT_SYSTEM_PROMPTS.get(line_user.language, DEFAULT_SYSTEM_PROMPT)
 
-     # 檢查是否為應跳過的關鍵字
-    if SkipKeyword.objects.filter(text__iexact=user_message).exists():
+    messages = [{'role': 'system', 'content': system_prompt}]
+    if summary_message(window):
+        messages.append(summary_message(window))
+    messages += window.history
+    messages += [{'role': 'user', 'content': user_message} for user_message in user_messages]
+    return session_id, system_prompt_rule, messages, window
+
+def record_llm_call(system_prompt_rule, model, seconds, usage):
+    """記錄各規則的 LLM 延遲與 token 用量；串流模式的延遲包含邊收邊送的時間"""
+    rule = str(system_prompt_rule.id) if system_prompt_rule else 'default'
+    metrics.observe('linebot_llm_seconds', seconds, rule=rule, model=model)
+    if usage is not None:
+        metrics.observe('linebot_llm_tokens', usage.prompt_tokens, metrics.TOKEN_BUCKETS, rule=rule, type='prompt')
+        metrics.observe(
+            'linebot_llm_tokens', usage.completion_tokens, metrics.TOKEN_BUCKETS, rule=rule, type='completion'
+        )
+
+def generate_reply(messages, system_prompt_rule, sender=None, deadline=None, indicator=None):
+    """取得 LLM 回覆，回傳 (回覆文字, usage)：有快取時直接使用，串流模式下邊收邊送；
+    indicator 只在快取未命中、需要等待 LLM 時才開始"""
+    backend, model = resolve(system_prompt_rule)
+    cache_model = f"{backend}:{model}"
+    cached = get_cached_reply(cache_model, messages, system_prompt_rule)
+    if cached is not None:
+        if sender:
+            sender.send(split_text(cached))
+        return cached, None
+
+    if indicator:
+        indicator.start()
+    started = time.perf_counter()
+    if sender:
+        stream, used_model = chat(
+            model,
+            messages,
+            deadline,
+            backend,
+            stream=True,
+            stream_options={'include_usage': True}
+        )
+        reply = sender.send_stream(stream)
+        usage = sender.usage
+    else:
+        response, used_model = chat(model, messages, deadline, backend)
+        reply = response.choices[0].message.content.strip()
+        usage = response.usage
+    record_llm_call(system_prompt_rule, used_model, time.perf_counter() - started, usage)
+
+    # 備援模型的回覆不寫入快取
+    if used_model == model:
+        cache_reply(cache_model, messages, system_prompt_rule, reply)
+    return reply, usage
+
+def update_session_summary(user_id, session_id, window):
+    """舊訊息滑出視窗且累積夠多時，以 LLM 增量更新 session 摘要（在回覆送出後執行）"""
+    request = pending_summary_request(user_id, session_id, window)
+    if request is None:
         return
 
-    # 思考動畫
-    send_loading(user_id, 5)
+    messages, covered_until_id = request
+    try:
+        backend, model = resolve()
+        response, _ = chat(model, messages, backend=backend)
+        store_summary(user_id, session_id, response.choices[0].message.content.strip(), covered_until_id)
+    except Exception as e:
+        print(f"[!] 更新對話摘要失敗：{str(e)}")
 
-    # 語言切換指令
-    if user_message.lower().startswith('/lang '):
-        new_lang = user_message[6:].strip().lower()
+def handle_message(event, line_user=None, wait=True):
+    """處理一則文字訊息；wait=False 表示同一批後面還有這位使用者的訊息，debounce 時只暫存不回答"""
+    user_id = event.source.user_id
+    user_message = event.message.text.strip()
 
-        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply))
+    # 指令最先處理，只載入指令需要的資源
+    matched = commands.match(user_message)
+    if matched:
+        metrics.count('linebot_commands_total', command=matched[0].name)
+        reply = commands.run(matched, user_id, line_user)
+        reply_token, _ = reply_deadline(event.reply_token, event.timestamp / 1000)
+        try:
+            with metrics.span('reply_send'):
+                reply_or_push(reply_token, user_id, text_messages(reply))
+        except Exception as e:
+            report_reply_error(e)
         return
 
-    if user_message.lower() == '/reset':
-        clear_history(user_id)
-        reply = '對話紀錄已清除，從頭開始吧！'
-        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply))
+    if line_user is None:
+        line_user = get_line_user(user_id)
+
+    # 檢查是否為應跳過的關鍵字
+    with metrics.span('rule_matching'):
+        skipped = is_skip_keyword(user_message)
+    if skipped:
+        metrics.count('linebot_skipped_messages_total')
         return
 
-    if user_message.lower() == '/history':
-        latest_msg = Message.objects.filter(user_id=user_id).order_by('-timestamp').first()
-        if latest_msg:
-            session_id = latest_msg.session_id
-            history = get_user_history(user_id, session_id)
-        else:
-            history = []
-        reply = '目前沒有紀錄喔～' if not history else (
-            '最近的對話紀錄：\n\n' + '\n'.join([f"[{h['role']}] {h['content']}" for h in history])
-        )
-        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply))
+    # 連續傳來的訊息先暫存，debounce 期間沒有新訊息才合併成一輪回答
+    if settings.LINEBOT_DEBOUNCE_SECONDS:
+        deferred = defer_message(user_id, user_message, event.reply_token)
+        if not wait:
+            return
+        time.sleep(settings.LINEBOT_DEBOUNCE_SECONDS)
+        if is_latest_deferred(deferred):
+            drain_deferred(line_user)
         return
 
-    system_prompt_obj = SystemPromptRule.objects.filter(trigger_text__iexact=user_message).first()
-    if system_prompt_obj:
-        system_prompt = system_prompt_obj.system_prompt
-        session_id = uuid.uuid4()
-        system_prompt_rule_id = system_prompt_obj.id
-    else:
-        latest_msg = Message.objects.filter(user_id=user_id).order_by('-timestamp').first()
-        if latest_msg and latest_msg.system_prompt_rule:
-            # 取到 SystemPromptRule instance 的 system_prompt
-            system_prompt = latest_msg.system_prompt_rule.system_prompt
-            system_prompt_rule_id = latest_msg.system_prompt_rule.id
-        else:
-            # 如果沒紀錄，fallback 給一個預設的 prompt
-            system_prompt = '要簡短回答，不要超過50字，對話的語系要用zh-tw'
-            system_prompt_rule_id = None
-        session_id = latest_msg.session_id if latest_msg else uuid.uuid4()
+    # 同一使用者同時只跑一個 LLM 回合，回覆期間新進的訊息先暫存，之後合併成一輪回答
+    if not acquire_user(user_id):
+        defer_message(user_id, user_message, event.reply_token)
+        metrics.count('linebot_deferred_messages_total')
+        # 前一輪可能在暫存寫入前就已結束並檢查過暫存訊息，暫存後自己再試一次
+        drain_deferred(line_user)
+        return
 
-    add_message(user_id, 'user', user_message, session_id, system_prompt_rule_id)
+    try:
+        answer_turn(line_user, [user_message], event.reply_token, event.timestamp / 1000)
+    finally:
+        deferred = release_user(user_id)
 
-    messages = [{'role': 'system', 'content': system_prompt}]
-    messages += get_user_history(user_id, session_id)
+    # 只有回答期間有訊息暫存時才需要再處理
+    if deferred:
+        drain_deferred(line_user)
+
+def answer_turn(line_user, user_messages, reply_token, received_at=None):
+    """以一次 LLM 呼叫回答這一輪的使用者訊息，送出回覆並寫入資料庫"""
+    user_id = line_user.user_id
+    sender = None
 
+    # 思考動畫在快取未命中、要呼叫 LLM 時才在背景送出；送出回覆前一定先停止
+    indicator = LoadingIndicator(user_id)
     try:
-        response = openai.chat.completions.create(
-            model='o4-mini',
-            messages=messages
-        )
-        reply = response.choices[0].message.content.strip()
-        add_message(user_id, 'assistant', reply, session_id, system_prompt_rule_id)
+        session_id, system_prompt_rule, messages, window = prepare_conversation(line_user, user_messages)
+
+        assistant_reply = usage = latency = None
+        allowed = take_llm_token()
+        # 等待額度也會花時間，送出前才判斷 reply token 是否還有效；過期時用完整的期限，改以 push 回覆
+        reply_token, deadline = reply_deadline(reply_token, received_at)
+        if settings.LINEBOT_STREAMING:
+            sender = StreamReplySender(reply_token, user_id, indicator)
+        if not allowed:
+            metrics.count('linebot_rate_limited_total')
+            reply = BUSY_REPLY
+        else:
+            try:
+                started = time.perf_counter()
+                with metrics.span('llm'):
+                    assistant_reply, usage = generate_reply(
+                        messages, system_prompt_rule, sender, deadline, indicator
+                    )
+                latency = time.perf_counter() - started
+                reply = assistant_reply
+            except Exception as e:
+                print(f"[!] 產生回覆失敗：{str(e)}")
+                metrics.count('linebot_errors_total', stage='llm')
+                reply = ERROR_REPLY
+
+        with metrics.span('persistence'):
+            save_turn(line_user, session_id, system_prompt_rule, user_messages, assistant_reply, usage, latency)
+    finally:
+        indicator.stop()
+
+    try:
+        with metrics.span('reply_send'):
+            if sender:
+                # 串流已經送出回覆；出錯時才補送錯誤訊息
+                if assistant_reply is None:
+                    sender.send([reply])
+            else:
+                reply_or_push(reply_token, user_id, TextSendMessage(text=reply))
     except Exception as e:
-        reply = f"抱歉，我出錯了：{str(e)}"
+        report_reply_error(e)
+
+    update_session_summary(user_id, session_id, window)
 
-    line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply))
+def drain_deferred(line_user):
+    """把上一輪回覆期間暫存的訊息合併成一輪回答，直到沒有暫存訊息
 
+    呼叫時觸發的事件已經回答或暫存過，出錯時只記錄錯誤，不往外丟，事件不會被釋放重新處理。
+    """
+    user_id = line_user.user_id
+    try:
+        while has_deferred(user_id) and acquire_user(user_id):
+            try:
+                # 別的 worker 可能已經更新過對話狀態
+                line_user.refresh_from_db(fields=['session_id', 'system_prompt_rule', 'message_count'])
+                user_messages, reply_token, received_at = pop_deferred(user_id)
+                if user_messages:
+                    answer_turn(line_user, user_messages, reply_token, received_at)
+            finally:
+                release_user(user_id)
+    except Exception as e:
+        print(f"[!] 回答暫存的訊息失敗：{str(e)}")
+        metrics.count('linebot_errors_total', stage='drain_deferred')
@@ -0,0 +1,18 @@
+# chatbot/warmup.py
+# worker 開始接收請求前先載入快取與對外連線用的 client，避免第一批請求承擔初始化的延遲
+import os
+
+from django.db import connections
+
+from . import line_client, rule_cache  # noqa: F401  line_client 在 import 時建立 LINE API 的連線池
+from .llm_backends import get_backend
+
+
+def warmup():
+    # SkipKeyword / SystemPromptRule 快取
+    rule_cache.warmup()
+    # LLM 後端的 client 第一次使用時才建立
+    get_backend()
+    # 這裡的 DB 連線屬於主執行緒，處理請求的執行緒會各自連線
+    connections.close_all()
+    print(f"worker {os.getpid()} warmup 完成")
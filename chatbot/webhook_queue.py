@@ -0,0 +1,65 @@
+# chatbot/webhook_queue.py
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from linebot.models import MessageEvent, TextMessage
+
+from .dedup import filter_new_events
+from .models import WebhookEvent
+
+
+def _source_id(event):
+    source = event.get('source') or {}
+    return source.get('userId') or source.get('groupId') or source.get('roomId') or ''
+
+
+def enqueue_webhook(body):
+    """把已驗證簽章的 webhook body 拆成事件寫入佇列（略過重送的事件），回傳寫入筆數"""
+    events = filter_new_events(json.loads(body).get('events', []))
+    WebhookEvent.objects.bulk_create([
+        WebhookEvent(
+            event_type=event.get('type', ''),
+            user_id=_source_id(event),
+            payload=event,
+        )
+        for event in events
+    ])
+    return len(events)
+
+
+def dispatch_event(payload):
+    """重建 LINE 事件並交給 handle_message"""
+    from .views import handle_message  # 避免與 views 循環 import
+
+    if payload.get('type') != 'message':
+        return
+
+    event = MessageEvent.new_from_json_dict(payload)
+    # 群組或聊天室中未同意提供資料的使用者沒有 userId，與同步模式一樣略過
+    if isinstance(event.message, TextMessage) and event.source.user_id:
+        handle_message(event)
+
+
+def retry_at(attempts):
+    """失敗的事件最早可以重試的時間，依已嘗試次數指數延長"""
+    delay = settings.LINEBOT_QUEUE_RETRY_BACKOFF * 2 ** (attempts - 1)
+    return timezone.now() + timedelta(seconds=delay)
+
+
+def process_event(webhook_event):
+    """處理單一佇列事件，成功回傳 True，失敗時記錄錯誤並回傳 False"""
+    webhook_event.attempts += 1
+    try:
+        dispatch_event(webhook_event.payload)
+    except Exception as e:
+        webhook_event.last_error = str(e)
+        webhook_event.save(update_fields=['attempts', 'last_error'])
+        print(f"[!] 佇列事件 {webhook_event.id} 處理失敗：{str(e)}")
+        return False
+
+    webhook_event.status = 'done'
+    webhook_event.processed_at = timezone.now()
+    webhook_event.save(update_fields=['attempts', 'status', 'processed_at'])
+    return True
@@ -0,0 +1,34 @@
+# gunicorn 設定：gunicorn -c gunicorn.conf.py
+# LINEBOT_WORKER_CLASS=gthread（WSGI，每個 worker 多個執行緒）或 uvicorn（ASGI，搭配 LINEBOT_WEBHOOK_MODE=async）
+import multiprocessing
+import os
+
+worker_class_name = os.getenv('LINEBOT_WORKER_CLASS', 'gthread')
+
+if worker_class_name == 'uvicorn':
+    worker_class = 'uvicorn.workers.UvicornWorker'
+    wsgi_app = 'linebot_project.asgi:application'
+else:
+    worker_class = 'gthread'
+    wsgi_app = 'linebot_project.wsgi:application'
+    # 等待 OpenAI / LINE 回應時執行緒會閒置，一個 worker 可以同時處理多個請求
+    threads = int(os.getenv('LINEBOT_THREADS', '8'))
+
+bind = os.getenv('LINEBOT_BIND', '127.0.0.1:8000')
+workers = int(os.getenv('LINEBOT_WORKERS', str(multiprocessing.cpu_count() + 1)))
+
+# LLM 呼叫最久約 LINEBOT_LLM_TIMEOUT 秒，worker 逾時要比它長
+timeout = int(os.getenv('LINEBOT_WORKER_TIMEOUT', '120'))
+graceful_timeout = 30
+keepalive = 5
+
+# 定期重啟 worker，避免記憶體持續成長
+max_requests = int(os.getenv('LINEBOT_MAX_REQUESTS', '2000'))
+max_requests_jitter = max_requests // 10
+
+
+def post_worker_init(worker):
+    """worker 載入 Django 之後、開始接收請求之前先預熱"""
+    from chatbot.warmup import warmup
+
+    warmup()
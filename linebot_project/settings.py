@@ -94,6 +94,25 @@ DATABASES = {
 }
 
 
+# Cache
+# default 為各 worker 自己的記憶體快取；shared 存在資料庫，讓所有 gunicorn worker 共用
+# shared 的資料表由 chatbot 的 migration 建立
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'linebot_cache',
+        'OPTIONS': {
+            # 每次寫入都會 COUNT(*) 整張表，只放少量的共用狀態；已處理的 webhook 事件 id 另存在 ProcessedEvent
+            'MAX_ENTRIES': 5000,
+        },
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -147,12 +166,112 @@ JAZZMIN_SETTINGS = {
     'show_sidebar': True,
     'navigation_expanded': True,
     'hide_apps': [],
+    'topmenu_links': [
+        {'name': '統計', 'url': 'admin:chatbot_hourlyrulestats_changelist', 'permissions': ['chatbot.view_hourlyrulestats']},
+    ],
     'icons': {
         'auth': 'fas fa-users-cog',
         'chatbot': 'fas fa-robot',
+        'chatbot.hourlyrulestats': 'fas fa-chart-line',
     },
 }
 
 CSRF_TRUSTED_ORIGINS = [
     'https://g1.dilab.online',
-]
\ No newline at end of file
+]
+
+# LineBot webhook 處理設定
+# sync：在 webhook 請求中直接處理；queue：驗證簽章後寫入佇列，由 process_webhook_events 背景處理
+# async：以 ASGI（uvicorn）執行，OpenAI 與 LINE 呼叫皆為非同步
+LINEBOT_WEBHOOK_MODE = os.getenv('LINEBOT_WEBHOOK_MODE', 'sync')
+LINEBOT_QUEUE_CONCURRENCY = int(os.getenv('LINEBOT_QUEUE_CONCURRENCY', '4'))
+LINEBOT_QUEUE_MAX_ATTEMPTS = int(os.getenv('LINEBOT_QUEUE_MAX_ATTEMPTS', '3'))
+# 失敗的事件等待 LINEBOT_QUEUE_RETRY_BACKOFF * 2^(已嘗試次數-1) 秒後才重試
+LINEBOT_QUEUE_RETRY_BACKOFF = float(os.getenv('LINEBOT_QUEUE_RETRY_BACKOFF', '5'))
+# 處理中的事件超過這個秒數沒有更新，視為 worker 已中斷，重新放回佇列
+LINEBOT_QUEUE_LEASE_SECONDS = int(os.getenv('LINEBOT_QUEUE_LEASE_SECONDS', '600'))
+
+# 對外呼叫 LINE API 的連線設定（秒）
+LINEBOT_HTTP_CONNECT_TIMEOUT = float(os.getenv('LINEBOT_HTTP_CONNECT_TIMEOUT', '3'))
+LINEBOT_HTTP_READ_TIMEOUT = float(os.getenv('LINEBOT_HTTP_READ_TIMEOUT', '10'))
+LINEBOT_HTTP_RETRIES = int(os.getenv('LINEBOT_HTTP_RETRIES', '2'))
+LINEBOT_HTTP_BACKOFF = float(os.getenv('LINEBOT_HTTP_BACKOFF', '0.3'))
+LINEBOT_HTTP_POOL_SIZE = int(os.getenv('LINEBOT_HTTP_POOL_SIZE', '10'))
+
+# 思考動畫秒數（LINE 規定 5 的倍數，5~60），生成較久時會自動延長
+LINEBOT_LOADING_SECONDS = int(os.getenv('LINEBOT_LOADING_SECONDS', '5'))
+
+# SkipKeyword / SystemPromptRule 記憶體快取多久向共用快取確認一次版本（秒）
+LINEBOT_RULE_CACHE_CHECK_INTERVAL = float(os.getenv('LINEBOT_RULE_CACHE_CHECK_INTERVAL', '5'))
+
+# 同一個 webhook 內有多位使用者的事件時，最多同時處理幾位
+LINEBOT_BATCH_CONCURRENCY = int(os.getenv('LINEBOT_BATCH_CONCURRENCY', '4'))
+
+# 已處理的 webhookEventId 保留多久（秒），期間內 LINE 重送的事件會直接略過
+LINEBOT_DEDUP_TTL = int(os.getenv('LINEBOT_DEDUP_TTL', '86400'))
+
+# 串流模式：OpenAI 回覆的第一句先用 reply 送出，其餘以 push message 補上（push 會計入訊息額度）
+LINEBOT_STREAMING = os.getenv('LINEBOT_STREAMING', 'false').lower() == 'true'
+LINEBOT_STREAM_PUSH_CHARS = int(os.getenv('LINEBOT_STREAM_PUSH_CHARS', '200'))
+
+# 對話紀錄的 token 預算：由新到舊放入 prompt，超出的舊訊息改用滾動摘要
+LINEBOT_HISTORY_TOKEN_BUDGET = int(os.getenv('LINEBOT_HISTORY_TOKEN_BUDGET', '2000'))
+LINEBOT_HISTORY_FETCH_LIMIT = int(os.getenv('LINEBOT_HISTORY_FETCH_LIMIT', '50'))
+# 滑出視窗、尚未摘要的訊息累積超過這個 token 數才更新摘要；設為 0 則停用摘要
+LINEBOT_SUMMARY_TRIGGER_TOKENS = int(os.getenv('LINEBOT_SUMMARY_TRIGGER_TOKENS', '500'))
+
+# LLM 回覆快取（只對後台勾選「快取回覆」的規則生效）
+LINEBOT_RESPONSE_CACHE_TTL = int(os.getenv('LINEBOT_RESPONSE_CACHE_TTL', '3600'))
+LINEBOT_RESPONSE_CACHE_SIZE = int(os.getenv('LINEBOT_RESPONSE_CACHE_SIZE', '256'))
+
+# OpenAI 流量控制：每位使用者同時只跑一個回合；全域每分鐘請求數依 OpenAI 方案設定（0 為不限制）
+LINEBOT_USER_LOCK_TIMEOUT = int(os.getenv('LINEBOT_USER_LOCK_TIMEOUT', '120'))
+LINEBOT_OPENAI_RPM = int(os.getenv('LINEBOT_OPENAI_RPM', '500'))
+LINEBOT_OPENAI_BURST = int(os.getenv('LINEBOT_OPENAI_BURST', '0'))  # 0 表示與 RPM 相同
+LINEBOT_RATE_LIMIT_WAIT = float(os.getenv('LINEBOT_RATE_LIMIT_WAIT', '2'))
+# reply token 的有效時間（秒），超過時改用 push message
+LINEBOT_REPLY_TOKEN_TTL = int(os.getenv('LINEBOT_REPLY_TOKEN_TTL', '50'))
+
+# 使用者連續傳訊息時，等待幾秒沒有新訊息才合併成一輪回答（0 為停用）
+LINEBOT_DEBOUNCE_SECONDS = float(os.getenv('LINEBOT_DEBOUNCE_SECONDS', '0'))
+
+# OpenAI 呼叫的期限與重試：有 reply token 時期限不超過 LINEBOT_REPLY_TOKEN_TTL
+LINEBOT_LLM_TIMEOUT = float(os.getenv('LINEBOT_LLM_TIMEOUT', '30'))
+LINEBOT_LLM_RETRIES = int(os.getenv('LINEBOT_LLM_RETRIES', '2'))
+LINEBOT_LLM_RETRY_BACKOFF = float(os.getenv('LINEBOT_LLM_RETRY_BACKOFF', '0.5'))
+# 斷路器：時間窗（秒）內至少 MIN_CALLS 次呼叫且錯誤率達 ERROR_RATE 時，暫停該模型 COOLDOWN 秒並改用備援模型
+LINEBOT_CIRCUIT_WINDOW = int(os.getenv('LINEBOT_CIRCUIT_WINDOW', '60'))
+LINEBOT_CIRCUIT_MIN_CALLS = int(os.getenv('LINEBOT_CIRCUIT_MIN_CALLS', '10'))
+LINEBOT_CIRCUIT_ERROR_RATE = float(os.getenv('LINEBOT_CIRCUIT_ERROR_RATE', '0.5'))
+LINEBOT_CIRCUIT_COOLDOWN = int(os.getenv('LINEBOT_CIRCUIT_COOLDOWN', '30'))
+LINEBOT_LLM_FALLBACK_MODEL = os.getenv('LINEBOT_LLM_FALLBACK_MODEL', 'gpt-4o-mini')
+
+# LLM 後端：openai、compatible（OpenAI 相容 API，需設定 base URL）、fake（模擬回覆，壓測用）
+# SystemPromptRule 可以另外指定後端與模型
+LINEBOT_LLM_BACKEND = os.getenv('LINEBOT_LLM_BACKEND', 'openai')
+LINEBOT_LLM_MODEL = os.getenv('LINEBOT_LLM_MODEL', 'o4-mini')
+LINEBOT_LLM_COMPATIBLE_BASE_URL = os.getenv('LINEBOT_LLM_COMPATIBLE_BASE_URL')
+LINEBOT_LLM_COMPATIBLE_API_KEY = os.getenv('LINEBOT_LLM_COMPATIBLE_API_KEY')
+# fake 後端：首字延遲（秒，對數常態分布的中位數與 sigma）、每秒 token 數、回覆長度
+LINEBOT_FAKE_LLM_LATENCY = float(os.getenv('LINEBOT_FAKE_LLM_LATENCY', '0.8'))
+LINEBOT_FAKE_LLM_LATENCY_SIGMA = float(os.getenv('LINEBOT_FAKE_LLM_LATENCY_SIGMA', '0.5'))
+LINEBOT_FAKE_LLM_TOKENS_PER_SECOND = float(os.getenv('LINEBOT_FAKE_LLM_TOKENS_PER_SECOND', '50'))
+LINEBOT_FAKE_LLM_REPLY_TOKENS = int(os.getenv('LINEBOT_FAKE_LLM_REPLY_TOKENS', '40'))
+
+# /metrics：各 worker 每 FLUSH_INTERVAL 秒把累計值寫入共用快取，停止超過 WORKER_TTL 秒的 worker 不再列入
+# 設定 LINEBOT_METRICS_TOKEN 時，抓取 /metrics 需帶 Authorization: Bearer <token>
+LINEBOT_METRICS_FLUSH_INTERVAL = float(os.getenv('LINEBOT_METRICS_FLUSH_INTERVAL', '10'))
+LINEBOT_METRICS_WORKER_TTL = int(os.getenv('LINEBOT_METRICS_WORKER_TTL', '86400'))
+LINEBOT_METRICS_TOKEN = os.getenv('LINEBOT_METRICS_TOKEN')
+
+# 對話紀錄的刪除與封存：/reset 與 archive_messages 每次刪除的筆數、最後一則訊息超過幾天的 session 要封存
+LINEBOT_PURGE_CHUNK_SIZE = int(os.getenv('LINEBOT_PURGE_CHUNK_SIZE', '1000'))
+LINEBOT_ARCHIVE_AFTER_DAYS = int(os.getenv('LINEBOT_ARCHIVE_AFTER_DAYS', '90'))
+LINEBOT_ARCHIVE_DIR = os.getenv('LINEBOT_ARCHIVE_DIR', str(BASE_DIR / 'archives'))
+
+# /history 每頁的訊息數；渲染好的頁面在 session 有新訊息前都可以重複使用
+LINEBOT_HISTORY_PAGE_SIZE = int(os.getenv('LINEBOT_HISTORY_PAGE_SIZE', '10'))
+LINEBOT_HISTORY_PAGE_CACHE_TTL = int(os.getenv('LINEBOT_HISTORY_PAGE_CACHE_TTL', '3600'))
+
+# 每小時統計（rollup_analytics）：每次從最後統計的小時再往前重新計算幾個小時，涵蓋較晚寫入的訊息
+LINEBOT_ANALYTICS_LOOKBACK_HOURS = int(os.getenv('LINEBOT_ANALYTICS_LOOKBACK_HOURS', '2'))
@@ -0,0 +1,34 @@
+"""
+正式站設定：以 DJANGO_SETTINGS_MODULE=linebot_project.settings_production 啟用，
+其餘設定與 settings.py 相同。搭配 gunicorn.conf.py 啟動。
+"""
+
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+
+from .settings import *  # noqa: F401,F403
+from .settings import DATABASES, MIDDLEWARE
+
+# DEBUG=True 時 Django 會把每個 SQL 查詢留在記憶體，正式站一定要關閉
+DEBUG = False
+
+# 正式站不使用 settings.py 中公開的金鑰，未設定時直接啟動失敗
+SECRET_KEY = os.getenv('DJANGO_SECRET_KEY')
+if not SECRET_KEY:
+    raise ImproperlyConfigured('正式站必須設定環境變數 DJANGO_SECRET_KEY')
+
+# DEBUG=False 時 Django 不提供 /static/，由 WhiteNoise 直接提供 collectstatic 收集到 STATIC_ROOT 的檔案（後台 jazzmin 的 CSS/JS）
+MIDDLEWARE = list(MIDDLEWARE)
+MIDDLEWARE.insert(MIDDLEWARE.index('django.middleware.security.SecurityMiddleware') + 1,
+                  'whitenoise.middleware.WhiteNoiseMiddleware')
+
+# gthread：每個 worker 執行緒保留自己的 MySQL 連線重複使用，不必每個請求重新連線；
+# 連線數約為 workers × threads，MySQL 的 max_connections 要足夠。
+# uvicorn（ASGI）下 Django 建議關閉持續連線，每個請求結束後關閉連線。
+# 使用前先檢查連線是否還活著，MySQL 端逾時斷線時自動重連。
+if os.getenv('LINEBOT_WORKER_CLASS', 'gthread') == 'uvicorn':
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+else:
+    DATABASES['default']['CONN_MAX_AGE'] = int(os.getenv('LINEBOT_DB_CONN_MAX_AGE', '300'))
+DATABASES['default']['CONN_HEALTH_CHECKS'] = True
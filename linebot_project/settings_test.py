@@ -0,0 +1,21 @@
+"""
+測試設定：pytest.ini 指定 DJANGO_SETTINGS_MODULE=linebot_project.settings_test，
+資料庫改為 SQLite，不需要 MySQL 與 LINE、OpenAI 的金鑰（LINE 與 LLM 的呼叫在測試中都是模擬）。
+"""
+
+import os
+
+# chatbot.views 與 line_client 在 import 時讀取這些環境變數
+os.environ.setdefault('LINE_CHANNEL_SECRET', 'test-channel-secret')
+os.environ.setdefault('LINE_CHANNEL_ACCESS_TOKEN', 'test-access-token')
+os.environ.setdefault('OPENAI_API_KEY', 'sk-test')
+
+from .settings import *  # noqa: F401,F403,E402
+
+# 記憶體中的資料庫，不會在專案目錄留下檔案
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    }
+}